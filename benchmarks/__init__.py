@@ -0,0 +1 @@
+"""Load tests and micro-benchmarks for the Book Site AI Agent"""
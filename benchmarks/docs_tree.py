@@ -0,0 +1,49 @@
+"""Deterministic synthetic Docusaurus docs trees for benchmarking"""
+import random
+from pathlib import Path
+
+SUBJECTS = ['sensor fusion', 'inverse kinematics', 'motion planning', 'reinforcement learning',
+            'imitation learning', 'object detection', 'grasping', 'localization', 'mapping',
+            'actuator control', 'safety monitoring', 'human-robot interaction', 'speech interfaces',
+            'tactile sensing', 'trajectory optimization', 'domain randomization', 'sim-to-real transfer',
+            'state estimation', 'visual servoing', 'path following']
+VOCABULARY = ('robot sensor camera lidar torque joint policy reward model dataset latency controller '
+              'feedback estimate noise filter kalman gradient network perception planning grasp force '
+              'safety human operator interface simulation environment trajectory velocity '
+              'acceleration calibration').split()
+
+
+def paragraph(rng, words=80):
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + '.'
+
+
+def render_doc(rng, index):
+    subject = SUBJECTS[index % len(SUBJECTS)]
+    title = f"{subject.title()} {index}"
+    lines = [
+        '---',
+        f'sidebar_position: {index}',
+        f'title: "{title}"',
+        '---',
+        '',
+        f'# {title}',
+        '',
+        paragraph(rng)
+    ]
+    for section in range(rng.randint(2, 4)):
+        topic = f"{rng.choice(SUBJECTS).title()} in practice {index}.{section}"
+        lines += ['', f'## {topic}', '', paragraph(rng)]
+        for sub in range(rng.randint(0, 2)):
+            lines += ['', f'### {rng.choice(VOCABULARY).title()} details {sub}', '', paragraph(rng, 60)]
+    return '\n'.join(lines) + '\n'
+
+
+def generate_docs_tree(root, files, seed=42, files_per_dir=50):
+    """Write `files` markdown docs under root/book/book-site/docs and return that path"""
+    rng = random.Random(seed)
+    docs_path = Path(root) / 'book' / 'book-site' / 'docs'
+    for index in range(files):
+        directory = docs_path / f'part{index // files_per_dir + 1:03d}'
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f'doc-{index:05d}.md').write_text(render_doc(rng, index), encoding='utf-8')
+    return docs_path
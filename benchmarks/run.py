@@ -0,0 +1,451 @@
+"""Load tests and micro-benchmarks for the Book Site AI Agent
+
+Starts a stub LLM and the agent (as separate processes) against synthetic
+docs trees of increasing size, drives concurrent traffic and writes the
+results as JSON:
+
+    python -m benchmarks.run --sizes 10,1000 --requests 500 --output bench.json
+    python -m benchmarks.run --sizes 10,1000 --compare bench.json
+
+See benchmarks/README.md for all options.
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+from benchmarks import stub_llm
+from benchmarks.docs_tree import SUBJECTS, generate_docs_tree
+from book_agent.providers import KNOWN_PROVIDERS
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+SUGGEST_QUERIES = ['sens', 'sensor fus', 'kinematcs', 'motion plan', 'grasp', 'reinforcment', 'local', 'safety mon']
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = min(max(1, math.ceil(p / 100 * len(sorted_values))), len(sorted_values))
+    return sorted_values[rank - 1]
+
+
+def summarize_latencies(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2),
+        'mean_ms': round(statistics.fmean(values) * 1000, 2)
+    }
+
+
+def stub_environment(stub_url):
+    """Point the agent at the stub only; empty values also stop .env from adding real providers"""
+    env = {key_variable: '' for _, key_variable, _, _ in KNOWN_PROVIDERS}
+    env.update({'GEMINI_API_KEY': 'benchmark', 'AI_API_URL': stub_url, 'GEMINI_API_URL': stub_url})
+    return env
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb(pid):
+    """High-water mark of a process's resident memory (Linux only, else None)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+class StubProcess:
+    """The stub LLM in its own process, so it does not compete with the load driver for the GIL"""
+
+    def __init__(self, stub_args):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.stub_llm', *stub_args],
+            cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True
+        )
+        self.port = int(self.process.stdout.readline())
+        self.url = f'http://127.0.0.1:{self.port}/v1/chat/completions'
+
+    def counters(self):
+        return requests.get(f'http://127.0.0.1:{self.port}/', timeout=5).json()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(10)
+
+
+class AgentProcess:
+    """The agent started the way it is deployed, with its startup time measured"""
+
+    def __init__(self, docs_path, stub_url, server='flask', extra_env=None):
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        env = dict(os.environ)
+        env.pop('FLASK_DEBUG', None)
+        env.update({
+            **stub_environment(stub_url),
+            'PORT': str(self.port),
+            'BOOK_DOCS_PATH': str(docs_path),
+            'DOCS_RELOAD_INTERVAL': '0',
+            'SERVER_MODE': server
+        })
+        env.update(extra_env or {})
+
+        started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, 'book_site_ai_agent.py'],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.startup_s = self._wait_until_healthy(started)
+
+    def _wait_until_healthy(self, started, timeout=600):
+        while time.perf_counter() - started < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Agent exited during startup with code {self.process.returncode}')
+            try:
+                if requests.get(f'{self.base_url}/health', timeout=1).status_code == 200:
+                    return round(time.perf_counter() - started, 3)
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.02)
+        raise RuntimeError('Agent did not become healthy in time')
+
+    def peak_rss_mb(self):
+        return peak_rss_mb(self.process.pid)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def make_questions(pool_size, seed):
+    rng = random.Random(seed)
+    templates = ['What is {}?', 'How does {} work on a real robot?', 'Explain {} in simple terms',
+                 'What are common failure modes of {}?', 'Compare {} and {}']
+    questions = []
+    for index in range(pool_size):
+        template = templates[index % len(templates)]
+        questions.append(template.format(rng.choice(SUBJECTS), rng.choice(SUBJECTS)) + f' ({index})')
+    return questions
+
+
+def parse_mix(text):
+    """'chat=5,book-info=3,suggest=2' -> {'chat': 5.0, ...}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in REQUEST_KINDS:
+            raise ValueError(f'Unknown request kind {name!r}; choose from {", ".join(REQUEST_KINDS)}')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def send_chat(session, base_url, question):
+    response = session.post(f'{base_url}/api/agent/chat', json={'question': question}, timeout=120)
+    return response.status_code, None
+
+
+def send_chat_stream(session, base_url, question):
+    started = time.perf_counter()
+    first_token = None
+    with session.post(f'{base_url}/api/agent/chat/stream', json={'question': question},
+                      timeout=120, stream=True) as response:
+        failed = False
+        for line in response.iter_lines(decode_unicode=True):
+            if first_token is None and line.startswith('event: token'):
+                first_token = time.perf_counter() - started
+            elif line.startswith('event: error'):
+                failed = True
+        status = 500 if failed else response.status_code
+    return status, first_token
+
+
+def send_book_info(session, base_url, question):
+    return session.get(f'{base_url}/api/book-info', timeout=30).status_code, None
+
+
+def send_suggest(session, base_url, query):
+    return session.get(f'{base_url}/api/suggest', params={'q': query}, timeout=30).status_code, None
+
+
+REQUEST_KINDS = {
+    'chat': send_chat,
+    'chat-stream': send_chat_stream,
+    'book-info': send_book_info,
+    'suggest': send_suggest
+}
+
+
+def drive_load(base_url, mix, total_requests, concurrency, questions, seed):
+    """Send total_requests requests from `concurrency` threads; returns per-kind summaries"""
+    rng = random.Random(seed)
+    kinds = list(mix)
+    schedule = []
+    for _ in range(total_requests):
+        kind = rng.choices(kinds, weights=[mix[k] for k in kinds])[0]
+        schedule.append((kind, rng.choice(SUGGEST_QUERIES if kind == 'suggest' else questions)))
+    next_index = itertools.count()
+    results = []
+    results_lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        local = []
+        while True:
+            index = next(next_index)
+            if index >= len(schedule):
+                break
+            kind, text = schedule[index]
+            started = time.perf_counter()
+            try:
+                status, first_token = REQUEST_KINDS[kind](session, base_url, text)
+            except requests.exceptions.RequestException:
+                status, first_token = None, None
+            local.append((kind, time.perf_counter() - started, status, first_token))
+        with results_lock:
+            results.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+
+    summary = {
+        'requests': len(results),
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(len(results) / elapsed, 2) if elapsed else None,
+        'errors': sum(1 for r in results if r[2] is None or r[2] >= 400),
+        'overall': summarize_latencies([r[1] for r in results]),
+        'by_kind': {}
+    }
+    for kind in kinds:
+        rows = [r for r in results if r[0] == kind]
+        entry = summarize_latencies([r[1] for r in rows])
+        entry['errors'] = sum(1 for r in rows if r[2] is None or r[2] >= 400)
+        entry['statuses'] = dict(sorted((str(s), sum(1 for r in rows if r[2] == s)) for s in {r[2] for r in rows}))
+        first_tokens = [r[3] for r in rows if r[3] is not None]
+        if first_tokens:
+            entry['time_to_first_token'] = summarize_latencies(first_tokens)
+        summary['by_kind'][kind] = entry
+    return summary
+
+
+def time_calls(fn, repeat, max_seconds):
+    """Call fn up to `repeat` times (at least once, stopping after max_seconds) and summarize"""
+    timings = []
+    deadline = time.perf_counter() + max_seconds
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+        if time.perf_counter() > deadline:
+            break
+    return {
+        'calls': len(timings),
+        'min_ms': round(min(timings) * 1000, 4),
+        'median_ms': round(statistics.median(timings) * 1000, 4),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 4)
+    }
+
+
+def micro_benchmarks(docs_path, stub_url, questions, repeat, max_seconds):
+    """Time the agent's hot functions in-process against one docs tree"""
+    os.environ.update({
+        **stub_environment(stub_url),
+        'BOOK_DOCS_PATH': str(docs_path),
+        'DOCS_RELOAD_INTERVAL': '0'
+    })
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    import book_site_ai_agent
+
+    agent = book_site_ai_agent.BookSiteAIAgent()
+    corpus = agent.corpus
+    cycle = itertools.cycle(questions)
+    queries = itertools.cycle(SUGGEST_QUERIES)
+
+    results = {
+        'load_book_content_from_docs': time_calls(agent.load_book_content_from_docs, repeat, max_seconds),
+        # The structure is part of the snapshot, so time building it with the indexes from parsed records
+        'build_snapshot': time_calls(agent.docs_corpus._build_snapshot, repeat, max_seconds),
+        'build_prompt': time_calls(lambda: agent.build_prompt(next(cycle), corpus), repeat * 20, max_seconds),
+        'generate_suggestions': time_calls(lambda: agent.generate_suggestions(next(cycle), corpus),
+                                           repeat * 20, max_seconds),
+        'suggest_prefix': time_calls(lambda: corpus.suggestions.search(next(queries)), repeat * 20, max_seconds)
+    }
+    agent.batch_executor.shutdown(wait=False)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(baseline, current):
+    """Lines describing how each shared metric moved between two result files"""
+    def index(report):
+        return {run['docs_files']: run for run in report['runs']}
+
+    def change(old, new):
+        if old in (None, 0) or new is None:
+            return ''
+        return f'{(new - old) / old * 100:+.1f}%'
+
+    lines = [f"baseline {baseline['meta'].get('commit')} -> current {current['meta'].get('commit')}"]
+    old_runs = index(baseline)
+    for files, run in index(current).items():
+        old = old_runs.get(files)
+        if old is None:
+            continue
+        lines.append(f'docs={files}')
+        for field in ('startup_s', 'peak_rss_mb'):
+            lines.append(f'  {field:<34} {old.get(field)!s:>10} -> {run.get(field)!s:>10} {change(old.get(field), run.get(field))}')
+        for kind, entry in run.get('load', {}).get('by_kind', {}).items():
+            old_entry = old.get('load', {}).get('by_kind', {}).get(kind, {})
+            for field in ('p50_ms', 'p95_ms', 'p99_ms'):
+                label = f'{kind} {field}'
+                lines.append(f'  {label:<34} {old_entry.get(field)!s:>10} -> {entry.get(field)!s:>10} '
+                             f'{change(old_entry.get(field), entry.get(field))}')
+        if 'load' in run and 'load' in old:
+            lines.append(f"  {'rps':<34} {old['load']['rps']!s:>10} -> {run['load']['rps']!s:>10} "
+                         f"{change(old['load']['rps'], run['load']['rps'])}")
+        for name, entry in run.get('micro', {}).items():
+            old_entry = old.get('micro', {}).get(name, {})
+            label = f'{name} median_ms'
+            lines.append(f'  {label:<34} {old_entry.get("median_ms")!s:>10} -> {entry["median_ms"]!s:>10} '
+                         f'{change(old_entry.get("median_ms"), entry["median_ms"])}')
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,1000', help='Comma-separated docs tree sizes (up to 10000)')
+    parser.add_argument('--requests', type=int, default=300, help='Requests per load run')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mix', default='chat=5,book-info=3,suggest=2',
+                        help='Weighted request kinds: chat, chat-stream, book-info, suggest')
+    parser.add_argument('--question-pool', type=int, default=100,
+                        help='Distinct chat questions; a smaller pool means more answer cache hits')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--micro-repeat', type=int, default=5)
+    parser.add_argument('--micro-max-seconds', type=float, default=5.0, help='Time cap per micro-benchmark')
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--keep-docs', action='store_true', help='Leave the generated docs trees on disk')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Earlier JSON results to compare against')
+    stub_llm.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    mix = parse_mix(args.mix)
+    questions = make_questions(args.question_pool, args.seed)
+    stub_args = [f'--latency-ms={args.latency_ms}', f'--jitter-ms={args.jitter_ms}',
+                 f'--token-delay-ms={args.token_delay_ms}', f'--tokens={args.tokens}',
+                 f'--error-rate={args.error_rate}', f'--error-status={args.error_status}',
+                 f'--rate-limit-rate={args.rate_limit_rate}', f'--seed={args.seed}']
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'started_at': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args)
+        },
+        'runs': []
+    }
+
+    stub = StubProcess(stub_args)
+    try:
+        for size in sizes:
+            run = {'docs_files': size}
+            workdir = tempfile.mkdtemp(prefix=f'book-bench-{size}-')
+            started = time.perf_counter()
+            docs_path = generate_docs_tree(workdir, size, seed=args.seed)
+            run['generate_s'] = round(time.perf_counter() - started, 3)
+            print(f'[{size} docs] generated in {run["generate_s"]}s', file=sys.stderr)
+
+            if not args.skip_load:
+                agent = AgentProcess(docs_path, stub.url, server=args.server)
+                try:
+                    run['startup_s'] = agent.startup_s
+                    run['load'] = drive_load(agent.base_url, mix, args.requests, args.concurrency,
+                                             questions, args.seed)
+                    run['peak_rss_mb'] = agent.peak_rss_mb()
+                finally:
+                    agent.stop()
+                print(f'[{size} docs] startup {run["startup_s"]}s, {run["load"]["rps"]} rps, '
+                      f'p95 {run["load"]["overall"].get("p95_ms")}ms, peak RSS {run["peak_rss_mb"]}MB',
+                      file=sys.stderr)
+
+            if not args.skip_micro:
+                run['micro'] = micro_benchmarks(docs_path, stub.url, questions, args.micro_repeat,
+                                                args.micro_max_seconds)
+                print(f'[{size} docs] micro: ' + ', '.join(
+                    f'{name} {entry["median_ms"]}ms' for name, entry in run['micro'].items()), file=sys.stderr)
+
+            if not args.keep_docs:
+                shutil.rmtree(workdir, ignore_errors=True)
+            report['runs'].append(run)
+        report['stub'] = stub.counters()
+    finally:
+        stub.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n', encoding='utf-8')
+    else:
+        print(output)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        print('\n'.join(compare(baseline, report)), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
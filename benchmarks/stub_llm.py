@@ -0,0 +1,198 @@
+"""OpenAI-compatible chat completions stub with latency, streaming and error injection
+
+Run on its own with `python -m benchmarks.stub_llm --port 8900 --latency-ms 200`,
+or let `benchmarks.run` start it. The chosen port is printed on the first
+line of stdout.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_WORDS = ("Physical AI combines perception, planning and control so that robots can act safely "
+                "and usefully in the real world, learning from sensors and from people.").split()
+
+
+class StubSettings:
+    """Behaviour of the stub; shared by all handler threads"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, token_delay_ms=0.0, tokens=40,
+                 error_rate=0.0, error_status=503, rate_limit_rate=0.0, retry_after=1, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_delay_ms = token_delay_ms
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'streamed': 0, 'errors': 0, 'rate_limited': 0}
+
+    def draw(self):
+        """Pick this request's latency and injected failure, if any"""
+        with self.lock:
+            self.counters['requests'] += 1
+            latency = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms))
+            roll = self.random.random()
+            if roll < self.rate_limit_rate:
+                self.counters['rate_limited'] += 1
+                return latency, 429
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.counters['errors'] += 1
+                return latency, self.error_status
+            return latency, None
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+
+def answer_text(settings):
+    return ' '.join(ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(settings.tokens))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; don't let Nagle delay the body
+    disable_nagle_algorithm = True
+    settings = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, payload, headers=()):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # Counters, for checking what the agent actually sent upstream
+        with self.settings.lock:
+            counters = dict(self.settings.counters)
+        self.send_body(200, counters)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_body(400, {'error': {'message': 'invalid JSON'}})
+            return
+
+        settings = self.settings
+        latency_ms, failure = settings.draw()
+        time.sleep(latency_ms / 1000)
+
+        if failure == 429:
+            self.send_body(429, {'error': {'message': 'rate limited'}}, [('Retry-After', str(settings.retry_after))])
+            return
+        if failure is not None:
+            self.send_body(failure, {'error': {'message': 'injected failure'}})
+            return
+
+        prompt_chars = sum(len(m.get('content', '')) for m in body.get('messages', []))
+        if body.get('stream'):
+            settings.count('streamed')
+            self.stream(settings)
+            return
+
+        self.send_body(200, {
+            'id': 'stub',
+            'object': 'chat.completion',
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer_text(settings)},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_chars // 4 + 1, 'completion_tokens': settings.tokens,
+                      'total_tokens': prompt_chars // 4 + 1 + settings.tokens}
+        })
+
+    def stream(self, settings):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def chunk(data):
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+
+        for i in range(settings.tokens):
+            word = ANSWER_WORDS[i % len(ANSWER_WORDS)] + ' '
+            event = {'choices': [{'index': 0, 'delta': {'content': word}}]}
+            chunk(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+            if settings.token_delay_ms:
+                time.sleep(settings.token_delay_ms / 1000)
+        chunk(b'data: [DONE]\n\n')
+        chunk(b'')
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections (e.g. the agent shutting down) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_stub(settings, host='127.0.0.1', port=0):
+    """Serve the stub on a background thread; returns the server"""
+    handler = type('Handler', (StubHandler,), {'settings': settings})
+    server = StubServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='stub-llm', daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='Delay before each response')
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help='Uniform +/- jitter on the delay')
+    parser.add_argument('--token-delay-ms', type=float, default=2.0, help='Delay between streamed tokens')
+    parser.add_argument('--tokens', type=int, default=40, help='Words per answer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with --error-status')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--seed', type=int, default=1234)
+
+
+def settings_from_args(args):
+    return StubSettings(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        token_delay_ms=args.token_delay_ms,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = start_stub(settings_from_args(args), args.host, args.port)
+    print(server.server_port, flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
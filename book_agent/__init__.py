@@ -0,0 +1 @@
+"""Supporting services for the Book Site AI Agent"""
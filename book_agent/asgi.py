@@ -0,0 +1,346 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+
+try:
+    import httpx
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # Only needed by the async serving mode
+    httpx = None
+    WsgiToAsgi = None
+
+from book_agent.conversations import normalize_conversation_id
+from book_agent.sse import sse_event
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamGate:
+    """Semaphore around upstream calls that refuses work once too many are waiting"""
+
+    def __init__(self, max_concurrency, max_waiting):
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def __aenter__(self):
+        if self.semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Exception("Upstream queue full")
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.active -= 1
+        self.semaphore.release()
+
+    def stats(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_waiting': self.max_waiting,
+            'active': self.active,
+            'waiting': self.waiting,
+            'rejected': self.rejected
+        }
+
+
+class AsyncChatApp:
+    """ASGI application for production serving
+
+    Chat requests are answered on the event loop with a non-blocking HTTP
+    client, so a waiting chat costs a coroutine rather than an OS thread.
+    The blocking steps around the upstream call (answer cache disk tier,
+    retrieval, similar question lookup) run in worker threads so they do not
+    stall the other chats. Every other route is passed through to the Flask
+    app unchanged.
+    """
+
+    CHAT_PATH = '/api/agent/chat'
+    STREAM_PATH = '/api/agent/chat/stream'
+
+    def __init__(self, agent, max_concurrency=64, max_waiting=1024):
+        if WsgiToAsgi is None:
+            raise RuntimeError("The async serving mode requires httpx, asgiref and uvicorn "
+                               "(pip install httpx asgiref uvicorn)")
+        self.agent = agent
+        self.flask_app = WsgiToAsgi(agent.app)
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.started = False
+        self.gate = None
+
+    async def startup(self):
+        """Create loop-bound resources"""
+        metrics = self.agent.metrics
+        metrics.gauge('upstream_gate_active', 'Async mode: upstream calls holding a slot').set_function(
+            lambda: self.gate.active)
+        metrics.gauge('upstream_gate_waiting', 'Async mode: chats waiting for a slot').set_function(
+            lambda: self.gate.waiting)
+        metrics.gauge('upstream_gate_rejected', 'Async mode: chats refused because the queue was full').set_function(
+            lambda: self.gate.rejected)
+        self.agent.router.start_async(min_pool_size=self.max_concurrency)
+        self.started = True
+        self.gate = UpstreamGate(self.max_concurrency, self.max_waiting)
+        self.agent.async_app = self
+        logger.info(f"Async chat ready: {self.max_concurrency} concurrent upstream calls, "
+                    f"{self.max_waiting} waiting at most")
+
+    async def shutdown(self):
+        if self.started:
+            await self.agent.router.aclose()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        if not self.started:
+            # Servers without lifespan support
+            await self.startup()
+
+        if scope['type'] == 'http' and scope['method'] == 'POST':
+            if scope['path'] == self.CHAT_PATH:
+                await self.instrumented(self.CHAT_PATH, self.chat, receive, send)
+                return
+            if scope['path'] == self.STREAM_PATH:
+                await self.instrumented(self.STREAM_PATH, self.chat_stream, receive, send)
+                return
+
+        await self.flask_app(scope, receive, send)
+
+    async def instrumented(self, route, handler, receive, send):
+        """Record the same request metrics as the Flask hooks for routes served here"""
+        agent = self.agent
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                agent.request_latency_metric.observe(time.perf_counter() - started, route=route, method='POST')
+            await send(message)
+
+        agent.requests_in_flight_metric.inc()
+        try:
+            await handler(receive, send_with_metrics)
+        finally:
+            agent.requests_in_flight_metric.dec()
+            agent.request_metric.inc(route=route, method='POST', status=status)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_json(self, receive):
+        """Read and decode a JSON request body"""
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    async def send_json(self, send, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode('ascii'))
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def call_ai_api(self, prompt):
+        """Async equivalent of BookSiteAIAgent.call_ai_api"""
+        def build(provider):
+            with self.agent.stage('request_encode'):
+                return self.agent.build_ai_request(prompt, provider=provider)
+
+        waiting = time.perf_counter()
+        async with self.gate:
+            self.agent.stage_metric.observe(time.perf_counter() - waiting, stage='gate_wait')
+            try:
+                with self.agent.stage('upstream'):
+                    data = await self.agent.router.post_json_async(build, self.agent.request_tokens(prompt))
+            except httpx.TimeoutException as e:
+                logger.error(f"Timed out calling AI API: {str(e)}")
+                raise Exception("Upstream timeout")
+            except httpx.HTTPError as e:
+                self.agent.raise_api_error(e)
+
+        self.agent.record_usage(data)
+
+        if 'choices' in data and len(data['choices']) > 0:
+            return data['choices'][0]['message']['content'].strip()
+        raise Exception("No response from AI API")
+
+    async def stream_ai_api(self, prompt):
+        """Async equivalent of BookSiteAIAgent.stream_ai_api"""
+        def build(provider):
+            with self.agent.stage('request_encode'):
+                return self.agent.build_ai_request(prompt, stream=True, provider=provider)
+
+        waiting = time.perf_counter()
+        async with self.gate:
+            self.agent.stage_metric.observe(time.perf_counter() - waiting, stage='gate_wait')
+            try:
+                async for text in self.agent.router.stream_chat_async(build, self.agent.request_tokens(prompt)):
+                    yield text
+            except httpx.TimeoutException as e:
+                logger.error(f"Timed out calling AI API: {str(e)}")
+                raise Exception("Upstream timeout")
+            except httpx.HTTPError as e:
+                self.agent.raise_api_error(e)
+
+    async def get_answer(self, question, corpus, conversation_id=None):
+        """Async equivalent of BookSiteAIAgent.get_answer"""
+        answer = await asyncio.to_thread(self.agent.prepare_answer, question, corpus, conversation_id)
+        if answer['cached']:
+            return answer
+
+        async def fetch():
+            response = await self.call_ai_api(answer['prompt'])
+            return (await asyncio.to_thread(self.agent.finish_answer, answer, response))['response']
+
+        response, coalesced = await self.agent.inflight.do_async(answer['key'], fetch)
+        if coalesced:
+            answer.update(response=response, coalesced=True)
+        self.agent.answers_metric.inc(source='coalesced' if coalesced else 'upstream')
+        return answer
+
+    async def chat(self, receive, send):
+        """POST /api/agent/chat on the event loop"""
+        data = await self.read_json(receive)
+        question = str(data.get('question', '')).strip()
+        conversation_id = normalize_conversation_id(data.get('conversation_id'))
+
+        logger.info(f'AI Agent received question: {question}')
+
+        if not question:
+            await self.send_json(send, {
+                'success': False,
+                'error': 'Question is required'
+            }, 400)
+            return
+
+        try:
+            corpus = self.agent.corpus
+            answer = await self.get_answer(question, corpus, conversation_id)
+
+            with self.agent.stage('conversation_record'):
+                conversation_entry = self.agent.record_conversation(question, answer['response'], conversation_id)
+            with self.agent.stage('suggestions'):
+                suggestions = self.agent.generate_suggestions(question, corpus)
+            await self.send_json(send, {
+                'success': True,
+                'response': answer['response'],
+                'cached': answer['cached'],
+                'coalesced': answer['coalesced'],
+                'similar': answer['similar'],
+                'conversation_id': conversation_entry['conversation_id'],
+                'entry_id': conversation_entry['id'],
+                'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'suggestions': suggestions
+            })
+        except Exception as e:
+            logger.error(f'Error processing agent chat request: {str(e)}')
+            error, status = self.agent.chat_error(e)
+            await self.send_json(send, {
+                'success': False,
+                'error': error
+            }, status)
+
+    async def chat_stream(self, receive, send):
+        """POST /api/agent/chat/stream on the event loop"""
+        data = await self.read_json(receive)
+        question = str(data.get('question', '')).strip()
+        conversation_id = normalize_conversation_id(data.get('conversation_id'))
+
+        logger.info(f'AI Agent received streaming question: {question}')
+
+        if not question:
+            await self.send_json(send, {
+                'success': False,
+                'error': 'Question is required'
+            }, 400)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no')
+            ]
+        })
+
+        async def emit(event, payload):
+            await send({'type': 'http.response.body', 'body': sse_event(event, payload).encode('utf-8'),
+                        'more_body': True})
+
+        corpus = self.agent.corpus
+        try:
+            answer = await asyncio.to_thread(self.agent.prepare_answer, question, corpus, conversation_id)
+            if answer['cached']:
+                await emit('token', {'text': answer['response']})
+            else:
+                parts = []
+                async for text in self.stream_ai_api(answer['prompt']):
+                    parts.append(text)
+                    await emit('token', {'text': text})
+                response = ''.join(parts).strip()
+                if not response:
+                    raise Exception("No response from AI API")
+                await asyncio.to_thread(self.agent.finish_answer, answer, response)
+                self.agent.answers_metric.inc(source='upstream')
+
+            conversation_entry = self.agent.record_conversation(question, answer['response'], conversation_id)
+            await emit('done', {
+                'success': True,
+                'cached': answer['cached'],
+                'similar': answer['similar'],
+                'conversation_id': conversation_entry['conversation_id'],
+                'entry_id': conversation_entry['id'],
+                'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'suggestions': self.agent.generate_suggestions(question, corpus)
+            })
+        except Exception as e:
+            logger.error(f'Error processing streaming chat request: {str(e)}')
+            error, status = self.agent.chat_error(e)
+            await emit('error', {
+                'success': False,
+                'error': error,
+                'status': status
+            })
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def stats(self):
+        return {
+            'gate': self.gate.stats() if self.gate else None
+        }
@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_question(question):
+    """Canonical form of a question used for cache keys"""
+    question = WHITESPACE_PATTERN.sub(' ', question.lower()).strip()
+    return question.rstrip('?!. ')
+
+
+def make_cache_key(question, *scope):
+    """Hash a normalized question together with whatever the answer depends on"""
+    material = '\n'.join([*(str(part) for part in scope), normalize_question(question)])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """In-process LRU/TTL answer cache with an optional SQLite tier"""
+
+    def __init__(self, max_entries=512, ttl=3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._open_db(db_path)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self._db is not None
+
+    def _open_db(self, db_path):
+        """Open the persistent tier and drop anything already expired"""
+        try:
+            self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS answers ('
+                'key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._db.execute('DELETE FROM answers WHERE expires_at < ?', (time.time(),))
+            self._db.commit()
+            logger.info(f"Answer cache persisted to {db_path}")
+        except sqlite3.Error as e:
+            logger.warning(f"Could not open answer cache database, using memory only: {str(e)}")
+            self._db = None
+
+    def get(self, key):
+        """Return a cached answer or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, answer = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return answer
+                del self._entries[key]
+                self.counters['expirations'] += 1
+
+        answer = self._db_get(key, now)
+        with self._lock:
+            if answer is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+        # Promote to memory so the next lookup skips the disk
+        self._remember(key, answer, now + self.ttl)
+        return answer
+
+    def put(self, key, answer):
+        """Store an answer in both tiers"""
+        expires_at = time.time() + self.ttl
+        self._remember(key, answer, expires_at)
+        if self._db is not None:
+            with self._db_lock:
+                try:
+                    self._db.execute('INSERT OR REPLACE INTO answers (key, answer, expires_at) VALUES (?, ?, ?)',
+                                     (key, answer, expires_at))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not persist cached answer: {str(e)}")
+
+    def _remember(self, key, answer, expires_at):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def _db_get(self, key, now):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            try:
+                row = self._db.execute('SELECT answer FROM answers WHERE key = ? AND expires_at > ?',
+                                       (key, now)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not read cached answer: {str(e)}")
+                return None
+        return row[0] if row else None
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size"""
+        with self._lock:
+            counters = dict(self.counters)
+            size = len(self._entries)
+        lookups = counters['hits'] + counters['disk_hits'] + counters['misses']
+        return {
+            **counters,
+            'size': size,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'persistent': self._db is not None,
+            'hit_rate': round((counters['hits'] + counters['disk_hits']) / lookups, 4) if lookups else 0.0
+        }
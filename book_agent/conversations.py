@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Low bits of an entry id hold the writing process, so workers sharing a database don't collide
+WORKER_BITS = 10
+
+
+def normalize_conversation_id(value):
+    """conversation_id from a request body as a string, or None when not given
+
+    Clients have sent numbers and other JSON values; they are stored by their
+    string form rather than failing the request.
+    """
+    if value is None or value == '':
+        return None
+    return value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+
+
+class ConversationStore:
+    """Conversation history indexed by entry id and conversation_id
+
+    The newest max_entries entries are kept in memory. With a db_path every
+    entry is also written to SQLite by a background thread, so older history
+    stays available without growing memory and the chat path never waits on
+    disk. Reads merge the entries still waiting for that thread instead of
+    waiting for it.
+    """
+
+    def __init__(self, max_entries=50, db_path=None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_conversation = {}
+        self._lock = threading.Lock()
+        self._last_id = 0
+        # Entries queued for the writer and not yet committed, by id
+        self._unwritten = OrderedDict()
+
+        self._db_path = db_path
+        self._reader = None
+        self._reader_lock = threading.Lock()
+        self._pending = None
+        self._writer = None
+        self.counters = {
+            'written': 0,
+            'write_errors': 0,
+            'write_conflicts': 0
+        }
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path):
+        try:
+            connection = sqlite3.connect(str(db_path), isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # One transaction, so workers opening the same file together seed the count once
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS conversations ('
+                'id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, question TEXT NOT NULL, '
+                'response TEXT NOT NULL, conversation_id TEXT NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS conversations_by_conversation '
+                               'ON conversations (conversation_id, id)')
+            # Row count kept by triggers, so total() never scans the table and sees every worker's writes
+            connection.execute('CREATE TABLE IF NOT EXISTS conversation_count (entries INTEGER NOT NULL)')
+            if connection.execute('SELECT COUNT(*) FROM conversation_count').fetchone()[0] == 0:
+                connection.execute('INSERT INTO conversation_count SELECT COUNT(*) FROM conversations')
+            connection.execute('CREATE TRIGGER IF NOT EXISTS conversations_insert AFTER INSERT ON conversations '
+                               'BEGIN UPDATE conversation_count SET entries = entries + 1; END')
+            connection.execute('CREATE TRIGGER IF NOT EXISTS conversations_delete AFTER DELETE ON conversations '
+                               'BEGIN UPDATE conversation_count SET entries = entries - 1; END')
+            connection.execute('COMMIT')
+            row = connection.execute('SELECT MAX(id) FROM conversations').fetchone()
+            self._last_id = row[0] or 0
+            connection.close()
+
+            self._reader = sqlite3.connect(str(db_path), check_same_thread=False)
+            self._pending = queue.Queue()
+            self._writer = threading.Thread(target=self._write_loop, name='conversation-writer', daemon=True)
+            self._writer.start()
+            logger.info(f"Conversation history persisted to {db_path}")
+        except sqlite3.Error as e:
+            logger.warning(f"Could not open conversation database, keeping history in memory only: {str(e)}")
+            self._reader = None
+            self._pending = None
+
+    def _next_id(self):
+        """Millisecond timestamp shifted left by WORKER_BITS, plus the process id in the low bits
+
+        Bumped to the next millisecond when two entries land in the same one.
+        The pid is read on every call so workers forked after startup get
+        their own ids.
+        """
+        millis = max(int(time.time() * 1000), (self._last_id >> WORKER_BITS) + 1)
+        self._last_id = (millis << WORKER_BITS) | (os.getpid() & ((1 << WORKER_BITS) - 1))
+        return self._last_id
+
+    def add(self, question, response, conversation_id=None):
+        """Store an entry and return it; without a conversation_id the entry starts a conversation of its own id"""
+        with self._lock:
+            entry_id = str(self._next_id())
+            entry = {
+                'id': entry_id,
+                'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'question': question,
+                'response': response,
+                'conversation_id': conversation_id or entry_id
+            }
+            self._entries[entry['id']] = entry
+            if self._pending is not None:
+                self._unwritten[entry['id']] = entry
+            self._by_conversation.setdefault(entry['conversation_id'], OrderedDict())[entry['id']] = None
+
+            while len(self._entries) > self.max_entries:
+                _, oldest = self._entries.popitem(last=False)
+                ids = self._by_conversation[oldest['conversation_id']]
+                del ids[oldest['id']]
+                if not ids:
+                    del self._by_conversation[oldest['conversation_id']]
+
+        if self._pending is not None:
+            self._pending.put(entry)
+        return entry
+
+    def get(self, entry_id):
+        """Look up one entry by id"""
+        with self._lock:
+            entry = self._entries.get(entry_id) or self._unwritten.get(entry_id)
+        if entry is not None or self._reader is None:
+            return entry
+
+        try:
+            entry_id = int(entry_id)
+        except (TypeError, ValueError):
+            return None
+        rows = self._query('SELECT id, timestamp, question, response, conversation_id '
+                           'FROM conversations WHERE id = ?', (entry_id,))
+        return rows[0] if rows else None
+
+    def list(self, cursor=None, limit=50, conversation_id=None):
+        """Entries after the cursor, oldest first; returns (entries, next_cursor)"""
+        after = 0
+        if cursor:
+            try:
+                after = int(cursor)
+            except (TypeError, ValueError):
+                raise ValueError('Invalid cursor')
+
+        if self._reader is not None:
+            # Taken before querying: an entry committed in between shows up in both and is deduplicated
+            with self._lock:
+                unwritten = [entry for entry in self._unwritten.values()
+                             if int(entry['id']) > after
+                             and (not conversation_id or entry['conversation_id'] == conversation_id)]
+            if conversation_id:
+                entries = self._query('SELECT id, timestamp, question, response, conversation_id FROM conversations '
+                                      'WHERE conversation_id = ? AND id > ? ORDER BY id LIMIT ?',
+                                      (conversation_id, after, limit + 1))
+            else:
+                entries = self._query('SELECT id, timestamp, question, response, conversation_id FROM conversations '
+                                      'WHERE id > ? ORDER BY id LIMIT ?', (after, limit + 1))
+            if unwritten:
+                merged = {entry['id']: entry for entry in entries}
+                merged.update((entry['id'], entry) for entry in unwritten)
+                entries = sorted(merged.values(), key=lambda entry: int(entry['id']))[:limit + 1]
+        else:
+            with self._lock:
+                if conversation_id:
+                    ids = list(self._by_conversation.get(conversation_id, ()))
+                else:
+                    ids = list(self._entries)
+                entries = []
+                for entry_id in ids:
+                    if int(entry_id) > after:
+                        entries.append(self._entries[entry_id])
+                        if len(entries) > limit:
+                            break
+
+        next_cursor = entries[limit - 1]['id'] if len(entries) > limit else None
+        return entries[:limit], next_cursor
+
+    def total(self):
+        """Number of stored entries (all of history when persisted)"""
+        if self._reader is None:
+            with self._lock:
+                return len(self._entries)
+        # Counted before the pending entries: one committed in between is counted twice rather than missed
+        with self._reader_lock:
+            stored = self._reader.execute('SELECT entries FROM conversation_count').fetchone()[0]
+        with self._lock:
+            return stored + len(self._unwritten)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _query(self, sql, params):
+        with self._reader_lock:
+            rows = self._reader.execute(sql, params).fetchall()
+        return [{
+            'id': str(row[0]),
+            'timestamp': row[1],
+            'question': row[2],
+            'response': row[3],
+            'conversation_id': row[4]
+        } for row in rows]
+
+    def _write_loop(self):
+        """Write queued entries in batches on a dedicated connection"""
+        connection = sqlite3.connect(str(self._db_path))
+        while True:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                cursor = connection.executemany(
+                    'INSERT OR IGNORE INTO conversations (id, timestamp, question, response, conversation_id) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(int(entry['id']), entry['timestamp'], entry['question'], entry['response'],
+                      entry['conversation_id']) for entry in batch]
+                )
+                connection.commit()
+                # An existing row with the same id is kept rather than overwritten
+                conflicts = len(batch) - cursor.rowcount
+                self.counters['written'] += len(batch) - conflicts
+                if conflicts:
+                    self.counters['write_conflicts'] += conflicts
+                    logger.warning(f"{conflicts} conversation entries not persisted: their ids were already taken")
+            except sqlite3.Error as e:
+                self.counters['write_errors'] += len(batch)
+                logger.warning(f"Could not persist conversation history: {str(e)}")
+            finally:
+                with self._lock:
+                    for entry in batch:
+                        self._unwritten.pop(entry['id'], None)
+                for _ in batch:
+                    self._pending.task_done()
+
+    def flush(self):
+        """Wait until queued entries are on disk"""
+        if self._pending is not None:
+            self._pending.join()
+
+    def stats(self):
+        with self._lock:
+            in_memory = len(self._entries)
+            conversations = len(self._by_conversation)
+        return {
+            'in_memory': in_memory,
+            'conversations': conversations,
+            'max_entries': self.max_entries,
+            'persistent': self._reader is not None,
+            'pending_writes': self._pending.qsize() if self._pending is not None else 0,
+            **self.counters
+        }
@@ -0,0 +1,264 @@
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from book_agent.retrieval import BM25Index, chunk_terms, split_into_chunks
+from book_agent.suggestions import SuggestionIndex
+
+logger = logging.getLogger(__name__)
+
+BOOK_TITLE_HEADER = "# Physical AI: Human-Robot Artificial Intelligence\n\n"
+
+
+def split_frontmatter(text):
+    """Return (frontmatter dict, body) for a markdown document"""
+    lines = text.split('\n')
+    if len(lines) > 2 and lines[0] == '---':
+        for i, line in enumerate(lines[1:], 1):
+            if line == '---':
+                frontmatter = {}
+                for entry in lines[1:i]:
+                    key, sep, value = entry.partition(':')
+                    if sep and key.strip() and not key.startswith((' ', '\t', '-')):
+                        frontmatter[key.strip()] = value.strip().strip('"\'')
+                return frontmatter, '\n'.join(lines[i + 1:])
+    return {}, text
+
+
+def parse_doc(file_path, docs_path, raw=None):
+    """Parse a markdown file once into a per-file record"""
+    if raw is None:
+        raw = file_path.read_bytes()
+    text = raw.decode('utf-8')
+    frontmatter, body = split_frontmatter(text)
+
+    title = None
+    headings = []
+    for line in text.split('\n'):
+        if line.startswith('#'):
+            level = len(line) - len(line.lstrip('#'))
+            if level <= 6 and line[level:level + 1] == ' ':
+                headings.append((level, line[level + 1:].strip()))
+                if title is None and level == 1:
+                    title = line[2:].strip()
+
+    chunks = split_into_chunks(body, source=file_path.name)
+    for chunk in chunks:
+        # Tokenized once here, so snapshots rebuilt after other files change reuse them
+        chunk['terms'] = chunk_terms(chunk)
+
+    relative_path = str(file_path.relative_to(docs_path))
+    return {
+        'path': relative_path,
+        'name': file_path.name,
+        'directory': file_path.parent.name,
+        'hash': hashlib.sha1(raw).hexdigest(),
+        'frontmatter': frontmatter,
+        'title': title or file_path.name.replace('.md', '').replace('-', ' ').replace('_', ' '),
+        'headings': headings,
+        'body': body,
+        'chunks': chunks
+    }
+
+
+class CorpusSnapshot:
+    """Immutable view of the parsed docs that requests read from
+
+    A snapshot is fully built before it is published, so a request that
+    grabbed one never sees a half-loaded corpus during a reload.
+    """
+
+    def __init__(self, records, version, fallback_content=None):
+        self.records = records
+        self.version = version
+
+        if fallback_content is not None:
+            self.book_content = fallback_content
+        else:
+            parts = [BOOK_TITLE_HEADER]
+            for record in records:
+                parts.append(f"\n\n## From {record['name']}\n\n{record['body']}")
+            self.book_content = ''.join(parts)
+
+        self.book_structure = {
+            'chapters': [{
+                'id': record['path'],
+                'title': record['title'],
+                'path': record['path'],
+                'directory': record['directory']
+            } for record in records],
+            'sections': [],
+            'topics': self._collect_topics(records)
+        }
+
+        if fallback_content is not None:
+            chunks = split_into_chunks(fallback_content)
+        else:
+            chunks = []
+            for record in records:
+                for chunk in record['chunks']:
+                    chunks.append(dict(chunk, id=len(chunks)))
+        self.index = BM25Index(chunks)
+        self.suggestions = SuggestionIndex.from_records(records, self.book_structure)
+
+    @staticmethod
+    def _collect_topics(records):
+        """Unique second-level headings in document order"""
+        topics = []
+        seen = set()
+        for record in records:
+            for level, text in record['headings']:
+                if level == 2 and text not in seen:
+                    seen.add(text)
+                    topics.append(text)
+        return topics
+
+
+class DocsCorpus:
+    """Single-pass docs loader with an mtime/hash manifest for hot reload
+
+    With a SnapshotStore, parsed snapshots are persisted and memory-mapped:
+    a process whose docs tree matches a stored snapshot maps it instead of
+    parsing, and a changed tree is rebuilt by one process and then mapped
+    by the others.
+    """
+
+    def __init__(self, docs_path, fallback_content=None, store=None):
+        self.docs_path = Path(docs_path)
+        self.fallback_content = fallback_content
+        self.store = store
+        self.manifest = {}
+        self.records = {}
+        # Mapped snapshot the records came from; their bodies and chunks stay in it
+        self.mapped = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def scan(self):
+        """Stat every markdown file without reading it"""
+        entries = {}
+        if not self.docs_path.exists():
+            return entries
+        for file_path in self.docs_path.rglob('*.md'):
+            try:
+                stat = file_path.stat()
+            except OSError:
+                continue
+            if file_path.is_file():
+                entries[str(file_path.relative_to(self.docs_path))] = (file_path, stat.st_mtime_ns, stat.st_size)
+        return entries
+
+    def load(self):
+        """Parse the whole docs tree and return the first snapshot"""
+        with self._lock:
+            if self.store is not None:
+                try:
+                    return self._load_stored(self.scan())
+                except Exception as e:
+                    logger.warning(f"Corpus snapshot store unavailable, parsing docs: {str(e)}")
+                    self.mapped = None
+            try:
+                self.manifest = {}
+                self.records = {}
+                self._apply_changes(self.scan())
+                return self._build_snapshot()
+            except Exception as e:
+                logger.warning(f"Could not read docs directory, using default content: {str(e)}")
+                return CorpusSnapshot([], 'fallback', fallback_content=self.fallback_content or BOOK_TITLE_HEADER)
+
+    def refresh(self):
+        """Re-parse changed files only; returns a new snapshot or None if nothing changed"""
+        with self._lock:
+            entries = self.scan()
+            if self.mapped is not None:
+                if self.store.manifest_key(entries) == self.mapped.key:
+                    return None
+                previous = self.mapped.version
+                snapshot = self._load_stored(entries)
+                return snapshot if snapshot.version != previous else None
+            if not self._apply_changes(entries):
+                return None
+            return self._build_snapshot()
+
+    def _load_stored(self, entries):
+        """Map the stored snapshot for these files, building it first if no process has yet"""
+        key = self.store.manifest_key(entries)
+        snapshot = self.store.open(key)
+        if snapshot is None:
+            with self.store.building(key):
+                # Another worker may have finished it while this one waited for the lock
+                snapshot = self.store.open(key)
+                if snapshot is None:
+                    if self.mapped is None:
+                        self.manifest = {}
+                        self.records = {}
+                    self._apply_changes(entries)
+                    snapshot = self.store.save(key, self._build_snapshot(), self.manifest)
+                    logger.info(f"Stored corpus snapshot {snapshot.path.name}")
+
+        self.manifest = dict(snapshot.manifest)
+        self.records = {record['path']: record for record in snapshot.records}
+        self.mapped = snapshot
+        return snapshot
+
+    def _apply_changes(self, entries):
+        """Update records for added, modified and deleted files"""
+        changed = False
+
+        for relative_path in list(self.manifest):
+            if relative_path not in entries:
+                del self.manifest[relative_path]
+                del self.records[relative_path]
+                changed = True
+
+        for relative_path, (file_path, mtime_ns, size) in entries.items():
+            known = self.manifest.get(relative_path)
+            if known and known[0] == mtime_ns and known[1] == size:
+                continue
+
+            raw = file_path.read_bytes()
+            digest = hashlib.sha1(raw).hexdigest()
+            if known and known[2] == digest:
+                # Touched but not edited; no need to parse it again
+                self.manifest[relative_path] = (mtime_ns, size, digest)
+                continue
+
+            self.records[relative_path] = parse_doc(file_path, self.docs_path, raw)
+            self.manifest[relative_path] = (mtime_ns, size, digest)
+            changed = True
+
+        return changed
+
+    def _build_snapshot(self):
+        """Assemble a snapshot from the current records"""
+        ordered = [self.records[path] for path in sorted(self.records)]
+        if self.mapped is not None:
+            # Unchanged files still only have their metadata in memory
+            ordered = [record if 'body' in record else self.mapped.parsed_record(record) for record in ordered]
+        version = hashlib.sha1(
+            '\n'.join(f"{path}:{self.manifest[path][2]}" for path in sorted(self.manifest)).encode('utf-8')
+        ).hexdigest()[:16]
+        return CorpusSnapshot(ordered, version)
+
+    def start_watching(self, interval, on_change):
+        """Poll the docs tree in the background and publish new snapshots"""
+        if self._watcher is not None or interval <= 0:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                try:
+                    snapshot = self.refresh()
+                    if snapshot is not None:
+                        on_change(snapshot)
+                except Exception as e:
+                    logger.warning(f"Docs reload failed: {str(e)}")
+
+        self._watcher = threading.Thread(target=watch, name='docs-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        """Stop the background watcher"""
+        self._stop.set()
@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+# Lower runs first when callers wait for upstream capacity
+PRIORITIES = {
+    'interactive': 0,
+    'batch': 1,
+    'warm': 2
+}
+
+
+class QueueFull(Exception):
+    """Raised when a request cannot be admitted; the message matches the agent's 503 mapping"""
+
+    def __init__(self, message="Upstream queue full"):
+        super().__init__(message)
+
+
+class RateLimiter:
+    """Admission control for one upstream: request and token buckets plus a priority queue
+
+    Both buckets refill continuously at their per-minute limit and hold up
+    to one minute's worth (a limit of 0 means unlimited). Callers that
+    cannot be admitted at once wait in a bounded queue ordered by priority,
+    then arrival; when the queue is full they are rejected immediately.
+
+    A 429 from the upstream halves the effective limits and pauses
+    admissions for the Retry-After period; every successful call then
+    restores a little of the limit (additive increase, multiplicative
+    decrease).
+    """
+
+    def __init__(self, rpm=0, tpm=0, max_queue=256, max_wait=30.0, min_scale=0.1, recovery=0.02,
+                 default_pause=1.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.min_scale = min_scale
+        self.recovery = recovery
+        self.default_pause = default_pause
+        self.scale = 1.0
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self.counters = {
+            'admitted': 0,
+            'queued': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'throttled': 0
+        }
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm * self.scale, self._requests + elapsed * self.rpm * self.scale / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm * self.scale, self._tokens + elapsed * self.tpm * self.scale / 60)
+
+    def _delay(self, tokens, now):
+        """Seconds until a call costing `tokens` fits; 0 when it fits now"""
+        delay = max(0.0, self._paused_until - now)
+        if self.rpm and self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60 / (self.rpm * self.scale))
+        if self.tpm:
+            # A single call larger than the bucket only has to wait for a full bucket
+            needed = min(tokens, self.tpm * self.scale)
+            if self._tokens < needed:
+                delay = max(delay, (needed - self._tokens) * 60 / (self.tpm * self.scale))
+        return delay
+
+    def _take(self, tokens):
+        if self.rpm:
+            self._requests -= 1
+        if self.tpm:
+            self._tokens -= min(tokens, self.tpm * self.scale)
+        self.counters['admitted'] += 1
+
+    def _enqueue(self, priority):
+        if len(self._waiters) >= self.max_queue:
+            self.counters['rejected'] += 1
+            raise QueueFull()
+        entry = (PRIORITIES.get(priority, PRIORITIES['interactive']), next(self._sequence))
+        heapq.heappush(self._waiters, entry)
+        self.counters['queued'] += 1
+        return entry
+
+    def _poll(self, entry, tokens, deadline):
+        """For a queued caller: None once admitted, otherwise seconds to wait before polling again"""
+        now = time.monotonic()
+        self._refill(now)
+        delay = None
+        if self._waiters[0] == entry:
+            delay = self._delay(tokens, now)
+            if delay == 0:
+                heapq.heappop(self._waiters)
+                self._take(tokens)
+                self._cond.notify_all()
+                return None
+
+        remaining = deadline - now
+        if remaining <= 0:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self.counters['timed_out'] += 1
+            self._cond.notify_all()
+            raise QueueFull()
+        return min(delay, remaining) if delay is not None else remaining
+
+    def _try_now(self, tokens):
+        now = time.monotonic()
+        self._refill(now)
+        if not self._waiters and self._delay(tokens, now) == 0:
+            self._take(tokens)
+            return True
+        return False
+
+    def acquire(self, tokens=0, priority='interactive'):
+        """Block until the call is admitted; raises QueueFull when it cannot be"""
+        with self._cond:
+            if self._try_now(tokens):
+                return
+            entry = self._enqueue(priority)
+            deadline = time.monotonic() + self.max_wait
+            while True:
+                delay = self._poll(entry, tokens, deadline)
+                if delay is None:
+                    return
+                self._cond.wait(delay)
+
+    async def acquire_async(self, tokens=0, priority='interactive'):
+        """Event-loop version of acquire; waits by sleeping instead of blocking the loop"""
+        with self._cond:
+            if self._try_now(tokens):
+                return
+            entry = self._enqueue(priority)
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while True:
+                with self._cond:
+                    delay = self._poll(entry, tokens, deadline)
+                if delay is None:
+                    return
+                # Threads get notified; coroutines re-check at least every 20 ms
+                await asyncio.sleep(min(delay, 0.02))
+        except asyncio.CancelledError:
+            with self._cond:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+            raise
+
+    def adjust(self, tokens):
+        """Correct the token bucket once a call's real usage is known (positive = used more)"""
+        if not self.tpm or not tokens:
+            return
+        with self._cond:
+            self._tokens = max(-self.tpm, self._tokens - tokens)
+            if tokens < 0:
+                self._cond.notify_all()
+
+    def throttled(self, retry_after=None):
+        """The upstream answered 429: pause admissions and tighten the limits"""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            self.scale = max(self.min_scale, self.scale / 2)
+            if self.rpm:
+                self._requests = min(self._requests, self.rpm * self.scale)
+            if self.tpm:
+                self._tokens = min(self._tokens, self.tpm * self.scale)
+            pause = retry_after if retry_after is not None else self.default_pause
+            self._paused_until = max(self._paused_until, now + pause)
+            self.counters['throttled'] += 1
+
+    def succeeded(self):
+        """A call went through: win back part of the limit lost to throttling"""
+        if self.scale < 1.0:
+            with self._cond:
+                self.scale = min(1.0, self.scale + self.recovery)
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            by_priority = {name: 0 for name in PRIORITIES}
+            names = {value: name for name, value in PRIORITIES.items()}
+            for priority, _ in self._waiters:
+                by_priority[names[priority]] += 1
+            return {
+                'rpm': self.rpm,
+                'tpm': self.tpm,
+                'scale': round(self.scale, 3),
+                'available_requests': round(self._requests, 2) if self.rpm else None,
+                'available_tokens': round(self._tokens) if self.tpm else None,
+                'paused_for': round(max(0.0, self._paused_until - now), 3),
+                'queue_depth': len(self._waiters),
+                'queue_by_priority': by_priority,
+                'max_queue': self.max_queue,
+                **self.counters
+            }
+
+    def busy(self):
+        """Whether a new call would have to wait"""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return bool(self._waiters) or self._delay(0, now) > 0
@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from book_agent.retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def _clip(text, tokens, keep='start'):
+    """Cut text to roughly `tokens` tokens (four characters each)"""
+    limit = max(0, tokens) * 4
+    if len(text) <= limit:
+        return text
+    if keep == 'end':
+        return '...' + text[len(text) - limit:]
+    return text[:limit] + '...'
+
+
+def render_turns(turns):
+    return '\n'.join(f"User: {question}\nAssistant: {answer}" for question, answer in turns)
+
+
+def extractive_summary(summary, turns, tokens):
+    """Summary without a model call: the earlier questions, newest kept when clipping"""
+    asked = '; '.join(question for question, _ in turns)
+    text = f"{summary} The user also asked: {asked}." if summary else f"The user asked: {asked}."
+    return _clip(text, tokens, keep='end')
+
+
+class ConversationMemory:
+    """Bounded per-conversation context for follow-up questions
+
+    The last max_turns question/answer pairs are kept verbatim. Older
+    turns are folded into a running summary by `summarize(summary, turns)`
+    on a background thread, so the request path never waits for it; until
+    then, and whenever summarizing fails, their questions are carried in
+    an extractive summary. The rendered context never exceeds
+    token_budget, which keeps the prompt size per turn flat however long
+    a conversation runs.
+
+    Conversations are dropped after idle_ttl seconds without a question
+    and, beyond max_conversations, least recently used first.
+    """
+
+    def __init__(self, max_turns=4, token_budget=1500, summary_tokens=300, max_conversations=1000,
+                 idle_ttl=1800, summarize=None):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_tokens = min(summary_tokens, token_budget // 2)
+        self.max_conversations = max_conversations
+        self.idle_ttl = idle_ttl
+        self.summarize = summarize
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='conversation-summary') \
+            if summarize else None
+        self.counters = {
+            'turns': 0,
+            'summaries': 0,
+            'summary_errors': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+
+    @property
+    def enabled(self):
+        return self.max_turns > 0 and self.token_budget > 0
+
+    def _expire(self, now):
+        while self._conversations:
+            conversation_id, state = next(iter(self._conversations.items()))
+            if now - state['last_used'] < self.idle_ttl:
+                break
+            del self._conversations[conversation_id]
+            self.counters['expirations'] += 1
+
+    def context(self, conversation_id):
+        """Summary and recent turns within the token budget: {'text', 'tokens', 'last_question'} or None"""
+        if not self.enabled or not conversation_id:
+            return None
+        with self._lock:
+            self._expire(time.monotonic())
+            state = self._conversations.get(conversation_id)
+            if state is None:
+                return None
+            summary = state['summary']
+            if state['unsummarized']:
+                # Turns still waiting for the summarizer are carried by their questions
+                summary = extractive_summary(summary, state['unsummarized'], self.summary_tokens)
+            turns = list(state['turns'])
+
+        parts = [f"Summary of the earlier conversation: {summary}"] if summary else []
+        used = estimate_tokens(parts[0]) if parts else 0
+        # Newest turns first until the budget is used up; what doesn't fit is left out
+        recent = []
+        for turn in reversed(turns):
+            cost = estimate_tokens(render_turns([turn]))
+            if used + cost > self.token_budget:
+                break
+            recent.insert(0, turn)
+            used += cost
+        if recent:
+            parts.append(render_turns(recent))
+        if not parts:
+            return None
+        text = '\n\n'.join(parts)
+        return {
+            'text': text,
+            'tokens': estimate_tokens(text),
+            'last_question': turns[-1][0] if turns else None
+        }
+
+    def record(self, conversation_id, question, answer):
+        """Remember a turn; turns pushed out of the window are summarized in the background"""
+        if not self.enabled or not conversation_id:
+            return
+        # Clipped so the newest turn always fits next to a full summary
+        turn = (_clip(question, self.token_budget // 8), _clip(answer, self.token_budget // 4))
+        now = time.monotonic()
+        schedule = None
+        with self._lock:
+            self._expire(now)
+            state = self._conversations.get(conversation_id)
+            if state is None:
+                state = self._conversations[conversation_id] = {
+                    'turns': deque(),
+                    'summary': '',
+                    'unsummarized': [],
+                    'summarizing': False,
+                    'last_used': now
+                }
+            self._conversations.move_to_end(conversation_id)
+            state['last_used'] = now
+            state['turns'].append(turn)
+            self.counters['turns'] += 1
+            while len(state['turns']) > self.max_turns:
+                state['unsummarized'].append(state['turns'].popleft())
+
+            if state['unsummarized']:
+                if self._executor is None:
+                    state['summary'] = extractive_summary(state['summary'], state['unsummarized'],
+                                                          self.summary_tokens)
+                    state['unsummarized'] = []
+                elif not state['summarizing']:
+                    state['summarizing'] = True
+                    schedule = state
+
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+                self.counters['evictions'] += 1
+
+        if schedule is not None:
+            self._executor.submit(self._summarize, schedule)
+
+    def _summarize(self, state):
+        """Fold the pending turns into the summary; runs on the summary thread"""
+        with self._lock:
+            summary = state['summary']
+            turns = list(state['unsummarized'])
+        try:
+            summary = _clip(self.summarize(summary, turns).strip(), self.summary_tokens)
+            self.counters['summaries'] += 1
+        except Exception as e:
+            logger.warning(f"Could not summarize conversation, keeping its questions only: {str(e)}")
+            self.counters['summary_errors'] += 1
+            summary = extractive_summary(summary, turns, self.summary_tokens)
+
+        with self._lock:
+            state['summary'] = summary
+            del state['unsummarized'][:len(turns)]
+            # More turns may have been pushed out while the model was summarizing
+            again = bool(state['unsummarized'])
+            state['summarizing'] = again
+        if again:
+            self._executor.submit(self._summarize, state)
+
+    def stats(self):
+        with self._lock:
+            conversations = len(self._conversations)
+            pending = sum(len(state['unsummarized']) for state in self._conversations.values())
+        return {
+            'conversations': conversations,
+            'max_conversations': self.max_conversations,
+            'max_turns': self.max_turns,
+            'token_budget': self.token_budget,
+            'pending_summaries': pending,
+            **self.counters
+        }
@@ -0,0 +1,93 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Low-overhead stack sampler that can be switched on and off at runtime
+
+    A background thread snapshots every other thread's stack at a fixed
+    interval and counts identical stacks. The result is in the folded
+    format that flame graph tools read ("frame;frame;frame count").
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None, reset=True):
+        """Start sampling; restarting with reset=True drops earlier samples"""
+        with self._lock:
+            if self.running:
+                return False
+            if interval:
+                self.interval = interval
+            if reset:
+                self.stacks = Counter()
+                self.samples = 0
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return False
+        self._stop.set()
+        thread.join()
+        return True
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            collected = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                collected.append(';'.join(reversed(stack)))
+            del frames
+
+            with self._lock:
+                self.stacks.update(collected)
+                self.samples += 1
+
+    def top(self, limit=20):
+        """Most frequently sampled stacks, hottest first"""
+        with self._lock:
+            return [{'stack': stack, 'count': count} for stack, count in self.stacks.most_common(limit)]
+
+    def folded(self):
+        """All samples in folded-stack format"""
+        with self._lock:
+            return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval_ms': round(self.interval * 1000, 3),
+                'samples': self.samples,
+                'distinct_stacks': len(self.stacks),
+                'started_at': self.started_at
+            }
@@ -0,0 +1,155 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+# Static part of the prompt; identical for every question against the same corpus
+SYSTEM_PROMPT_TEMPLATE = """You are an advanced AI Agent for the "Physical AI: Human-Robot Artificial Intelligence" book.
+Your capabilities include:
+1. Answering questions about the book content
+2. Providing detailed explanations of concepts
+3. Guiding users to specific chapters or sections
+4. Summarizing key topics
+5. Making connections between different concepts
+
+Book Structure:
+Chapters: {chapters} (first 10 of {chapter_count} chapters)
+Topics: {topics} (first 10 topics)
+{book_section}
+Provide a helpful, accurate, and comprehensive response based on the book content.
+When relevant, suggest specific chapters or sections that might interest the user.
+Keep your responses informative and well-structured."""
+
+# Included in the system prompt when the whole book is sent (RETRIEVAL_FULL_CONTENT)
+FULL_BOOK_SECTION = """
+Use the following book information to answer the user's question:
+
+{book_content}
+"""
+
+# Per-question part, sent as the user message after the cached prefix
+USER_PROMPT_TEMPLATE = """Use the following book information to answer the user's question:
+
+{book_context}
+
+{history_section}User Question: {question}"""
+
+USER_PROMPT_TEMPLATE_FULL = """{history_section}User Question: {question}"""
+
+# Earlier turns of the same conversation, so follow-up questions can be resolved
+HISTORY_SECTION = """Conversation so far:
+{history}
+
+"""
+
+# Background request that folds older turns into a conversation's running summary
+SUMMARY_PROMPT = """Summarize this conversation about the "Physical AI: Human-Robot Artificial Intelligence" book in at most {words} words.
+Keep the topics, chapters and facts the user asked about so that later follow-up questions can be understood.
+Reply with the summary only."""
+
+
+class PromptBuilder:
+    """Builds prompts from a system prefix cached once per corpus version
+
+    The prefix (instructions, structure summary and, in full-content mode,
+    the whole book) is rendered and JSON-encoded once when the corpus
+    changes. Each request only renders the short user message and splices
+    it after the cached bytes. Providers with prompt caching can then reuse
+    the identical prefix across requests.
+    """
+
+    def __init__(self, full_content=False):
+        self.full_content = full_content
+        self._prefix = None
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=500)
+        self.counters = {
+            'builds': 0,
+            'prefix_builds': 0
+        }
+
+    def fingerprint_material(self):
+        """Template text that changes what the model would answer"""
+        return '\n'.join([SYSTEM_PROMPT_TEMPLATE, FULL_BOOK_SECTION, USER_PROMPT_TEMPLATE,
+                          USER_PROMPT_TEMPLATE_FULL, HISTORY_SECTION, str(self.full_content)])
+
+    def prefix(self, corpus):
+        """The rendered and encoded system prompt for a corpus snapshot"""
+        cached = self._prefix
+        if cached is not None and cached['version'] == corpus.version:
+            return cached
+
+        with self._lock:
+            if self._prefix is None or self._prefix['version'] != corpus.version:
+                structure = corpus.book_structure
+                book_section = FULL_BOOK_SECTION.format(book_content=corpus.book_content) if self.full_content else ''
+                text = SYSTEM_PROMPT_TEMPLATE.format(
+                    # Capped like topics so the prefix does not grow with the book; retrieval supplies the content
+                    chapters=', '.join([ch['title'] for ch in structure['chapters'][:10]]),
+                    chapter_count=len(structure['chapters']),
+                    topics=', '.join(structure['topics'][:10]),
+                    book_section=book_section
+                )
+                encoded = json.dumps(text).encode('utf-8')
+                self._prefix = {
+                    'version': corpus.version,
+                    'text': text,
+                    'encoded': encoded
+                }
+                self.counters['prefix_builds'] += 1
+            return self._prefix
+
+    def build(self, corpus, question, book_context=None, history=None):
+        """Prompt for one question: the cached prefix plus a user message
+
+        `history` is the conversation context text; it goes into the user
+        message so the cached prefix stays the same for every conversation.
+        """
+        started = time.perf_counter()
+        blocks_before = sys.getallocatedblocks()
+
+        prefix = self.prefix(corpus)
+        history_section = HISTORY_SECTION.format(history=history) if history else ''
+        if self.full_content:
+            user = USER_PROMPT_TEMPLATE_FULL.format(history_section=history_section, question=question)
+        else:
+            user = USER_PROMPT_TEMPLATE.format(book_context=book_context or '', history_section=history_section,
+                                               question=question)
+        prompt = {
+            'system': prefix['text'],
+            'system_encoded': prefix['encoded'],
+            'user': user,
+            'user_encoded': json.dumps(user).encode('utf-8')
+        }
+        prompt['bytes'] = len(prompt['system_encoded']) + len(prompt['user_encoded'])
+
+        sample = {
+            'build_ms': (time.perf_counter() - started) * 1000,
+            'bytes': prompt['bytes'],
+            # Process-wide, so concurrent requests add some noise
+            'allocated_blocks': max(0, sys.getallocatedblocks() - blocks_before)
+        }
+        with self._lock:
+            self.counters['builds'] += 1
+            self._recent.append(sample)
+        return prompt
+
+    def stats(self):
+        """Prompt build time, size and allocation figures over recent requests"""
+        with self._lock:
+            recent = list(self._recent)
+            counters = dict(self.counters)
+            prefix = self._prefix
+
+        def average(field):
+            return round(sum(s[field] for s in recent) / len(recent), 3) if recent else None
+
+        return {
+            **counters,
+            'prefix_version': prefix['version'] if prefix else None,
+            'prefix_bytes': len(prefix['encoded']) if prefix else 0,
+            'avg_build_ms': average('build_ms'),
+            'avg_bytes': average('bytes'),
+            'avg_allocated_blocks': average('allocated_blocks')
+        }
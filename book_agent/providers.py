@@ -0,0 +1,546 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from book_agent.limiter import QueueFull, RateLimiter
+from book_agent.upstream import AsyncUpstreamClient, Cancelled, CancelToken
+
+logger = logging.getLogger(__name__)
+
+# OpenAI-compatible chat completion backends, in the order API keys are looked up:
+# (name, API key variable, default URL, default model)
+KNOWN_PROVIDERS = [
+    ('gemini', 'GEMINI_API_KEY',
+     'https://generativelanguage.googleapis.com/v1beta/openai/chat/completions', 'gemini-2.0-flash'),
+    ('dashscope', 'DASHSCOPE_API_KEY',
+     'https://dashscope-intl.aliyuncs.com/compatible-mode/v1/chat/completions', 'qwen-plus'),
+    ('openai', 'OPENAI_API_KEY', 'https://api.openai.com/v1/chat/completions', 'gpt-4o-mini'),
+    ('openrouter', 'OpenRouter_API_KEY', 'https://openrouter.ai/api/v1/chat/completions', 'mistralai/devstral-2512:free')
+]
+
+
+def configured_providers(environ=None):
+    """(name, key variable, api key, url, model) for every backend with an API key set
+
+    <NAME>_API_URL and <NAME>_MODEL override a backend's endpoint and model,
+    e.g. GEMINI_API_URL. The older AI_API_URL and AI_MODEL still apply to
+    the first backend found.
+    """
+    environ = os.environ if environ is None else environ
+    found = []
+    for name, key_variable, default_url, default_model in KNOWN_PROVIDERS:
+        api_key = environ.get(key_variable)
+        if not api_key:
+            continue
+        prefix = name.upper()
+        url = environ.get(f'{prefix}_API_URL')
+        model = environ.get(f'{prefix}_MODEL')
+        if not found:
+            url = url or environ.get('AI_API_URL')
+            model = model or environ.get('AI_MODEL')
+        found.append((name, key_variable, api_key, url or default_url, model or default_model))
+    return found
+
+
+class Provider:
+    """One backend with its client and a moving window of recent outcomes"""
+
+    def __init__(self, name, url, api_key, model, client, window_size=100, window_seconds=300.0, limiter=None):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.client = client
+        self.async_client = None
+        # Admission control against this provider's own quota
+        self.limiter = limiter or RateLimiter()
+        client.on_rate_limited = self.limiter.throttled
+        self.window_seconds = window_seconds
+        self._samples = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.counters = {
+            'requests': 0,
+            'failures': 0,
+            'ejections': 0,
+            'hedges_won': 0
+        }
+
+    def _recent(self, now):
+        cutoff = now - self.window_seconds
+        return [sample for sample in self._samples if sample[0] >= cutoff]
+
+    def record(self, ok, latency=None):
+        """Add one outcome; latency is None for calls that are not comparable (streams)"""
+        with self._lock:
+            self.counters['requests'] += 1
+            self._samples.append((time.monotonic(), latency, ok))
+            if ok:
+                self.consecutive_failures = 0
+            else:
+                self.counters['failures'] += 1
+                self.consecutive_failures += 1
+
+    def latency_percentile(self, p, now=None):
+        with self._lock:
+            values = sorted(s[1] for s in self._recent(now or time.monotonic()) if s[2] and s[1] is not None)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    def error_rate(self, now=None):
+        with self._lock:
+            recent = self._recent(now or time.monotonic())
+        return sum(1 for s in recent if not s[2]) / len(recent) if recent else 0.0
+
+    def sample_count(self, now=None):
+        with self._lock:
+            return len(self._recent(now or time.monotonic()))
+
+    def stats(self):
+        now = time.monotonic()
+        p50 = self.latency_percentile(50, now)
+        p95 = self.latency_percentile(95, now)
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'url': self.url,
+            'model': self.model,
+            'healthy': self.ejected_until <= now,
+            'window_samples': self.sample_count(now),
+            'error_rate': round(self.error_rate(now), 4),
+            'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000, 2) if p95 is not None else None,
+            'consecutive_failures': self.consecutive_failures,
+            **counters,
+            'limiter': self.limiter.stats(),
+            'client': self.client.stats(),
+            'async_client': self.async_client.stats() if self.async_client else None
+        }
+
+
+class HedgeTimer:
+    """One thread that runs callbacks after a delay, so a pending hedge does not hold a thread"""
+
+    def __init__(self):
+        self._heap = []
+        self._condition = threading.Condition()
+        self._ids = itertools.count()
+        self._thread = None
+
+    def schedule(self, delay, callback):
+        entry = [time.monotonic() + delay, next(self._ids), callback]
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='hedge-timer', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return entry
+
+    @staticmethod
+    def cancel(entry):
+        # Left in the heap and skipped when due
+        entry[2] = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        callback = heapq.heappop(self._heap)[2]
+                        break
+                    self._condition.wait(self._heap[0][0] - now if self._heap else None)
+            if callback is not None:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.warning(f"Hedge callback failed: {str(e)}")
+
+
+class ProviderRouter:
+    """Sends each chat request to the fastest healthy backend
+
+    Backends are ranked by median latency over a moving window. A backend
+    with a high error rate or several failures in a row is ejected for a
+    cooldown, then gets one trial request. Failed calls fail over to the
+    next backend. With hedging on, a second backend is asked as well when
+    the first has not answered within its own p95 latency, and the first
+    answer wins.
+
+    The first backend is called on the caller's thread and its hedge delay
+    starts once its rate limiter has admitted the call, so queueing never
+    triggers hedges. Hedges run on a small pool and are capped at
+    hedge_ratio of requests (with a burst of hedge_burst); when the budget
+    or the pool is used up, a slow request simply waits.
+
+    `build(provider)` callables return the (headers, payload) for a
+    provider, since the model and API key differ between backends.
+    `tokens` is the estimated cost of the call for the provider's rate
+    limiter and `priority` its place in the limiter's wait queue.
+    """
+
+    def __init__(self, providers, hedge=False, hedge_min_delay=0.05, hedge_max_delay=5.0, hedge_ratio=0.1,
+                 hedge_burst=10, max_error_rate=0.5, min_samples=5, eject_after=3, cooldown=30.0, metrics=None):
+        if not providers:
+            raise ValueError('At least one provider is required')
+        self.providers = providers
+        self.hedge = hedge and len(providers) > 1
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.eject_after = eject_after
+        self.cooldown = cooldown
+        self.hedge_ratio = hedge_ratio
+        self.hedge_burst = hedge_burst
+        self._lock = threading.Lock()
+        self._hedge_workers = max(4, max(p.client.pool_size for p in providers))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._hedge_workers,
+            thread_name_prefix='hedge'
+        ) if self.hedge else None
+        self._timer = HedgeTimer() if self.hedge else None
+        self._hedge_credit = float(hedge_burst)
+        self._hedges_in_flight = 0
+        self.counters = {
+            'requests': 0,
+            'failovers': 0,
+            'hedged': 0,
+            'hedges_skipped': 0
+        }
+
+        if metrics is not None:
+            metrics.gauge('upstream_provider_healthy', 'Whether a backend is currently eligible for traffic',
+                          ('provider',)).set_function(
+                lambda: {(p.name,): int(p.ejected_until <= time.monotonic()) for p in self.providers})
+            metrics.gauge('upstream_provider_p50_seconds', 'Median latency of a backend over the moving window',
+                          ('provider',)).set_function(
+                lambda: {(p.name,): p.latency_percentile(50) or 0 for p in self.providers})
+            for field, documentation in [
+                ('queue_depth', 'Calls waiting for rate limiter capacity'),
+                ('scale', 'Fraction of the configured rate limits currently allowed'),
+                ('available_requests', 'Requests left in the per-minute bucket'),
+                ('available_tokens', 'Tokens left in the per-minute bucket')
+            ]:
+                metrics.gauge(f'upstream_limiter_{field}', documentation, ('provider',)).set_function(
+                    lambda field=field: {(p.name,): p.limiter.stats()[field] or 0 for p in self.providers})
+            for field in ('admitted', 'rejected', 'timed_out', 'throttled'):
+                metrics.counter(f'upstream_limiter_{field}_total', f'Rate limiter calls {field.replace("_", " ")}',
+                                ('provider',)).set_function(
+                    lambda field=field: {(p.name,): p.limiter.counters[field] for p in self.providers})
+
+    @property
+    def primary(self):
+        return self.providers[0]
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _observe(self, provider, ok, latency=None):
+        provider.record(ok, latency)
+        if ok:
+            return
+        now = time.monotonic()
+        unhealthy = provider.consecutive_failures >= self.eject_after or (
+            provider.sample_count(now) >= self.min_samples and provider.error_rate(now) >= self.max_error_rate)
+        if unhealthy and provider.ejected_until <= now:
+            provider.ejected_until = now + self.cooldown
+            provider.counters['ejections'] += 1
+            logger.warning(f"Provider {provider.name} ejected for {self.cooldown:.0f}s "
+                           f"(error rate {provider.error_rate(now):.0%})")
+
+    def ranked(self):
+        """Healthy backends fastest first, then ejected ones as a last resort
+
+        Backends that could take the call right away go before ones whose
+        rate limiter would make it wait.
+        """
+        now = time.monotonic()
+
+        def speed(provider):
+            # Backends without samples yet go first so they get measured
+            p50 = provider.latency_percentile(50, now)
+            return provider.limiter.busy(), p50 if p50 is not None else 0.0
+
+        healthy = sorted((p for p in self.providers if p.ejected_until <= now), key=speed)
+        ejected = sorted((p for p in self.providers if p.ejected_until > now), key=lambda p: p.ejected_until)
+        return healthy + ejected
+
+    def hedge_delay(self, provider):
+        p95 = provider.latency_percentile(95)
+        if p95 is None or provider.sample_count() < self.min_samples:
+            return self.hedge_max_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, p95))
+
+    def _earn_hedge(self):
+        with self._lock:
+            self._hedge_credit = min(float(self.hedge_burst), self._hedge_credit + self.hedge_ratio)
+
+    def _take_hedge(self, pooled=True):
+        """Whether the hedge budget (and, for threads, the hedge pool) has room for one more hedge"""
+        with self._lock:
+            if self._hedge_credit < 1 or (pooled and self._hedges_in_flight >= self._hedge_workers):
+                self.counters['hedges_skipped'] += 1
+                return False
+            self._hedge_credit -= 1
+            if pooled:
+                self._hedges_in_flight += 1
+            return True
+
+    def _hedge_finished(self):
+        with self._lock:
+            self._hedges_in_flight -= 1
+
+    def _succeeded(self, provider, data, tokens, latency=None):
+        self._observe(provider, True, latency)
+        provider.limiter.succeeded()
+        usage = data.get('usage') if isinstance(data, dict) else None
+        if usage and isinstance(usage.get('total_tokens'), int):
+            provider.limiter.adjust(usage['total_tokens'] - tokens)
+
+    def _call(self, provider, build, tokens, priority, cancel=None, on_admitted=None):
+        # Raises QueueFull without counting against the provider's health
+        provider.limiter.acquire(tokens, priority)
+        if on_admitted is not None:
+            on_admitted()
+        headers, payload = build(provider)
+        started = time.perf_counter()
+        try:
+            data = provider.client.post_json(payload, headers, cancel=cancel)
+        except Cancelled:
+            # Losing a hedge race says nothing about the backend's health
+            raise
+        except Exception:
+            self._observe(provider, False)
+            raise
+        self._succeeded(provider, data, tokens, time.perf_counter() - started)
+        return data
+
+    def post_json(self, build, tokens=0, priority='interactive'):
+        """POST to the best backend, failing over on errors; returns the decoded body"""
+        self._count('requests')
+        candidates = self.ranked()
+        if self.hedge and len(candidates) > 1:
+            self._earn_hedge()
+            return self._post_hedged(candidates, build, tokens, priority)
+        return self._post_failover(candidates, build, tokens, priority)
+
+    def _post_failover(self, candidates, build, tokens, priority, error=None):
+        """Try backends in order on this thread; error is the previous backend's failure, if any"""
+        for provider in candidates:
+            if error is not None:
+                self._count('failovers')
+                logger.warning(f"Failing over to provider {provider.name}")
+            try:
+                return self._call(provider, build, tokens, priority)
+            except Exception as e:
+                error = e
+        raise error
+
+    def _post_hedged(self, candidates, build, tokens, priority):
+        primary, backup = candidates[0], candidates[1]
+        cancel = CancelToken()
+        lock = threading.Lock()
+        state = {'finished': False, 'hedge': None, 'timer': None}
+
+        def run_hedge():
+            try:
+                data = self._call(backup, build, tokens, priority)
+            finally:
+                self._hedge_finished()
+            # First answer wins: wake the caller's thread out of the primary call
+            cancel.cancel()
+            return data
+
+        def start_hedge():
+            with lock:
+                if state['finished'] or not self._take_hedge():
+                    return
+                self._count('hedged')
+                state['hedge'] = self._executor.submit(run_hedge)
+
+        def admitted():
+            state['timer'] = self._timer.schedule(self.hedge_delay(primary), start_hedge)
+
+        error = None
+        try:
+            return self._call(primary, build, tokens, priority, cancel, admitted)
+        except Cancelled:
+            pass
+        except Exception as e:
+            error = e
+        finally:
+            with lock:
+                state['finished'] = True
+            if state['timer'] is not None:
+                self._timer.cancel(state['timer'])
+
+        hedge = state['hedge']
+        if hedge is None:
+            return self._post_failover(candidates[1:], build, tokens, priority, error)
+        try:
+            data = hedge.result()
+        except Exception as e:
+            return self._post_failover(candidates[2:], build, tokens, priority, e)
+        backup.counters['hedges_won'] += 1
+        return data
+
+    def stream_chat(self, build, tokens=0, priority='interactive'):
+        """Stream from the best backend; fails over only before the first delta"""
+        self._count('requests')
+        error = None
+        for attempt, provider in enumerate(self.ranked()):
+            if attempt:
+                self._count('failovers')
+                logger.warning(f"Failing over to provider {provider.name}")
+            try:
+                provider.limiter.acquire(tokens, priority)
+            except QueueFull as e:
+                error = e
+                continue
+            headers, payload = build(provider)
+            started = False
+            try:
+                for text in provider.client.stream_chat(payload, headers):
+                    started = True
+                    yield text
+            except Exception as e:
+                self._observe(provider, False)
+                if started:
+                    raise
+                error = e
+                continue
+            self._succeeded(provider, None, tokens)
+            return
+        raise error
+
+    def start_async(self, min_pool_size=0):
+        """Create an async client per backend (call on the serving event loop)"""
+        for provider in self.providers:
+            settings = provider.client.settings()
+            settings['pool_size'] = max(settings['pool_size'], min_pool_size)
+            provider.async_client = AsyncUpstreamClient(**settings)
+            provider.async_client.on_rate_limited = provider.limiter.throttled
+
+    async def aclose(self):
+        for provider in self.providers:
+            if provider.async_client is not None:
+                await provider.async_client.aclose()
+
+    async def _call_async(self, provider, build, tokens, priority, on_admitted=None):
+        await provider.limiter.acquire_async(tokens, priority)
+        if on_admitted is not None:
+            on_admitted()
+        headers, payload = build(provider)
+        started = time.perf_counter()
+        try:
+            data = await provider.async_client.post_json(payload, headers)
+        except Exception:
+            self._observe(provider, False)
+            raise
+        self._succeeded(provider, data, tokens, time.perf_counter() - started)
+        return data
+
+    async def post_json_async(self, build, tokens=0, priority='interactive'):
+        """Event-loop version of post_json"""
+        self._count('requests')
+        candidates = self.ranked()
+        hedging = self.hedge and len(candidates) > 1
+        if hedging:
+            self._earn_hedge()
+        admitted = asyncio.Event()
+        tasks = {asyncio.ensure_future(self._call_async(candidates[0], build, tokens, priority, admitted.set)):
+                 candidates[0]}
+        remaining = list(candidates[1:])
+        delay = self.hedge_delay(candidates[0])
+        error = None
+        try:
+            while tasks:
+                if hedging and remaining and not admitted.is_set():
+                    # The hedge delay starts once the rate limiter has admitted the call
+                    admission = asyncio.ensure_future(admitted.wait())
+                    await asyncio.wait([*tasks, admission], return_when=asyncio.FIRST_COMPLETED)
+                    admission.cancel()
+                timeout = delay if hedging and remaining else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if not self._take_hedge(pooled=False):
+                        # Out of hedge budget: keep waiting on the calls already made
+                        hedging = False
+                        continue
+                    provider = remaining.pop(0)
+                    self._count('hedged')
+                    tasks[asyncio.ensure_future(self._call_async(provider, build, tokens, priority))] = provider
+                    delay = self.hedge_delay(provider)
+                    continue
+
+                for task in done:
+                    provider = tasks.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if provider is not candidates[0]:
+                        provider.counters['hedges_won'] += 1
+                    return task.result()
+
+                if remaining and not tasks:
+                    provider = remaining.pop(0)
+                    self._count('failovers')
+                    logger.warning(f"Failing over to provider {provider.name}")
+                    tasks[asyncio.ensure_future(self._call_async(provider, build, tokens, priority))] = provider
+            raise error
+        finally:
+            # Unlike threads, a losing coroutine can simply be cancelled
+            for task in tasks:
+                task.cancel()
+
+    async def stream_chat_async(self, build, tokens=0, priority='interactive'):
+        """Event-loop version of stream_chat"""
+        self._count('requests')
+        error = None
+        for attempt, provider in enumerate(self.ranked()):
+            if attempt:
+                self._count('failovers')
+                logger.warning(f"Failing over to provider {provider.name}")
+            try:
+                await provider.limiter.acquire_async(tokens, priority)
+            except QueueFull as e:
+                error = e
+                continue
+            headers, payload = build(provider)
+            started = False
+            try:
+                async for text in provider.async_client.stream_chat(payload, headers):
+                    started = True
+                    yield text
+            except Exception as e:
+                self._observe(provider, False)
+                if started:
+                    raise
+                error = e
+                continue
+            self._succeeded(provider, None, tokens)
+            return
+        raise error
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'hedge': self.hedge,
+            'hedge_ratio': self.hedge_ratio,
+            'counters': counters,
+            'order': [p.name for p in self.ranked()],
+            'providers': {p.name: p.stats() for p in self.providers}
+        }
+
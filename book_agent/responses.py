@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip is always available
+    brotli = None
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+class PrecomputedPayload:
+    """A JSON body serialized and compressed once, served with an ETag"""
+
+    def __init__(self, body, content_type='application/json'):
+        self.content_type = content_type
+        self.tag = hashlib.sha1(body).hexdigest()[:20]
+        self.bodies = {'identity': body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.bodies['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body, quality=11)
+
+    def etag(self, encoding):
+        """Strong ETag per encoding, so caches never mix up the variants"""
+        return self.tag if encoding == 'identity' else f"{self.tag}-{encoding}"
+
+    def choose_encoding(self, accept_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+    def response(self, request):
+        """200 with the best encoding the client accepts, or 304 if it is current"""
+        encoding = self.choose_encoding(request.accept_encodings)
+        etag = self.etag(encoding)
+
+        # Any variant of the current payload is still valid for the client. If-None-Match uses weak
+        # comparison: proxies that compress or recompress (nginx gzip) send back W/"..." tags. contains_weak
+        # also covers "*"
+        if any(request.if_none_match.contains_weak(self.etag(name)) for name in self.bodies):
+            response = Response(status=304)
+        else:
+            response = Response(self.bodies[encoding], content_type=self.content_type)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+class PayloadCache:
+    """Rendered payloads reused until the corpus version changes"""
+
+    def __init__(self):
+        self._version = None
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, version, render):
+        """Payload for name at this corpus version; render() returns the body bytes"""
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._payloads = {}
+            payload = self._payloads.get(name)
+        if payload is not None:
+            return payload
+
+        payload = PrecomputedPayload(render())
+        with self._lock:
+            if version == self._version:
+                self._payloads.setdefault(name, payload)
+        return payload
+
+
+class FileHashes:
+    """Content hashes of static files, re-read only when size or mtime change"""
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def etag(self, path):
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            known = self._hashes.get(path)
+        if known is not None and known[0] == key:
+            return known[1]
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                digest.update(block)
+        etag = digest.hexdigest()[:20]
+        with self._lock:
+            self._hashes[path] = (key, etag)
+        return etag
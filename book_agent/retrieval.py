@@ -0,0 +1,215 @@
+import functools
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+# Words that carry no retrieval signal on their own
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further
+had has have having he her here hers him his how i if in into is it its itself just me more
+most my no nor not now of off on once only or other our ours out over own same she should so
+some such than that the their theirs them then there these they this those through to too
+under until up very was we were what when where which while who whom why will with would you
+your yours please tell explain describe give show
+""".split())
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*\S)\s*$')
+
+
+# Suffixes stripped by the light stemmer, longest first
+SUFFIXES = ('ational', 'ization', 'fulness', 'ousness', 'iveness', 'ations', 'ation', 'ments',
+            'ement', 'ness', 'ment', 'ings', 'ing', 'ies', 'ied', 'ers', 'er', 'ed', 'es', 's')
+
+
+# The vocabulary is small next to the number of tokens, so most calls are cache hits
+@functools.lru_cache(maxsize=65536)
+def stem(word):
+    """Reduce a word to a crude stem so "sensors" and "sensor" match"""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            base = word[:-len(suffix)]
+            if suffix in ('ies', 'ied'):
+                return base + 'y'
+            if suffix == 's' and base.endswith(('s', 'u')):
+                # Leave words like "class" and "status" alone
+                return word
+            return base
+    return word
+
+
+def tokenize(text):
+    """Split text into lower-cased, stemmed search terms without stopwords"""
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def chunk_terms(chunk):
+    """(term, frequency) pairs of a chunk; headings are indexed with the body so section titles match queries"""
+    return tuple(Counter(tokenize(f"{chunk['heading']}\n{chunk['text']}")).items())
+
+
+def estimate_tokens(text):
+    """Rough token count for budgeting (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+def split_into_chunks(content, source='book', max_chars=2400):
+    """Split markdown into heading-bounded chunks
+
+    Every heading starts a new chunk. Sections longer than max_chars are
+    split further on paragraph boundaries so a single chunk never dominates
+    the prompt budget.
+    """
+    chunks = []
+    heading_path = []
+    current_lines = []
+    current_source = source
+
+    def flush():
+        body = '\n'.join(current_lines).strip()
+        # Skip empty sections and headings that are immediately followed by a subheading
+        if not body or HEADING_PATTERN.match(body):
+            return
+        heading = ' > '.join(title for _, title in heading_path)
+        for part in _split_long_section(body, max_chars):
+            chunks.append({
+                'id': len(chunks),
+                'source': current_source,
+                'heading': heading,
+                'text': part
+            })
+
+    for line in content.split('\n'):
+        match = HEADING_PATTERN.match(line.strip())
+        if match:
+            flush()
+            current_lines = []
+            level = len(match.group(1))
+            title = match.group(2)
+
+            # The combined book text marks file boundaries with "## From <file>"
+            if level == 2 and title.startswith('From ') and title.endswith('.md'):
+                current_source = title[5:]
+                heading_path = []
+                continue
+
+            heading_path = [(lvl, text) for lvl, text in heading_path if lvl < level]
+            heading_path.append((level, title))
+        current_lines.append(line)
+
+    flush()
+    return chunks
+
+
+def _split_long_section(body, max_chars):
+    """Split an oversized section on blank lines"""
+    if len(body) <= max_chars:
+        return [body]
+
+    parts = []
+    current = ''
+    for paragraph in body.split('\n\n'):
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            parts.append(current)
+            current = ''
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+
+        # A single paragraph can still be larger than the limit
+        while len(current) > max_chars:
+            parts.append(current[:max_chars])
+            current = current[max_chars:]
+
+    if current.strip():
+        parts.append(current)
+    return parts
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over book chunks
+
+    Chunks carrying precomputed 'terms' (see chunk_terms) are not tokenized
+    again, so rebuilding after a docs change only tokenizes changed files.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = []
+
+        postings = defaultdict(list)
+        for position, chunk in enumerate(chunks):
+            terms = chunk.get('terms')
+            if terms is None:
+                terms = chunk_terms(chunk)
+            length = 0
+            for term, frequency in terms:
+                postings[term].append((position, frequency))
+                length += frequency
+            self.doc_lengths.append(length)
+        self.postings = dict(postings)
+
+        total = len(self.doc_lengths)
+        self.avg_doc_length = (sum(self.doc_lengths) / total) if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+        self.length_norms = self.compute_length_norms()
+
+    def compute_length_norms(self):
+        """Per-chunk k1 * (1 - b + b * length / avg_length), the query-independent part of the score"""
+        avg_length = self.avg_doc_length or 1.0
+        k1, b = self.k1, self.b
+        return [k1 * (1 - b + b * length / avg_length) for length in self.doc_lengths]
+
+    def search(self, query, top_k=5):
+        """Return up to top_k (score, chunk) pairs ranked by BM25 score"""
+        length_norms = self.length_norms
+        # Dense scores: indexing a list is cheaper than a dict, and zero means no query term matched
+        scores = [0.0] * len(length_norms)
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            weight = self.idf[term] * (self.k1 + 1)
+            for position, frequency in postings:
+                scores[position] += weight * frequency / (frequency + length_norms[position])
+
+        # nlargest is stable, so the earlier chunk wins ties
+        ranked = heapq.nlargest(top_k, range(len(scores)), key=scores.__getitem__)
+        return [(scores[position], self.chunks[position]) for position in ranked if scores[position] > 0]
+
+    def select_context(self, query, top_k=5, token_budget=2000):
+        """Pick the best matching chunks that fit inside the token budget
+
+        Falls back to the opening chunks of the book when nothing matches,
+        so greetings and very generic questions still get some grounding.
+        """
+        ranked = [chunk for _, chunk in self.search(query, top_k)]
+        if not ranked:
+            ranked = self.chunks[:top_k]
+
+        selected = []
+        used = 0
+        for chunk in ranked:
+            cost = estimate_tokens(chunk['text'])
+            if used + cost > token_budget:
+                continue
+            selected.append(chunk)
+            used += cost
+        return selected
+
+
+def format_chunks(chunks):
+    """Render selected chunks as prompt context"""
+    sections = []
+    for chunk in chunks:
+        label = f"{chunk['source']} - {chunk['heading']}" if chunk['heading'] else chunk['source']
+        sections.append(f"[{label}]\n{chunk['text']}")
+    return '\n\n'.join(sections)
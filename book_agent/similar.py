@@ -0,0 +1,216 @@
+import itertools
+import random
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+
+from book_agent.retrieval import STOPWORDS, TOKEN_PATTERN, stem
+
+# Question words change what is being asked; questions only match others with the same ones
+INTENT_WORDS = frozenset(['how', 'why', 'when', 'where', 'who', 'no', 'not'])
+# Comparisons are one-sided: "LIDAR over cameras" asks something else than "cameras over LIDAR"
+COMPARISON_WORDS = frozenset(['over', 'vs', 'versus', 'than', 'compared', 'instead', 'rather', 'unlike'])
+
+# MinHash permutations XOR a random 32-bit mask into the CRC32 of each shingle
+HASH_BITS = 32
+
+
+def question_features(question):
+    """(intent key, shingles) of a question
+
+    Shingles are character trigrams of the stemmed words that are not
+    stopwords; trigrams rather than whole words, so "use" and "used" or a
+    typo still mostly overlap. Word order does not matter, except in
+    comparisons.
+
+    Questions only match others with the same intent key: the same
+    question words and numbers ("chapter 3" is not "chapter 4"), and for
+    comparisons the same words in the same order.
+    """
+    intent = set()
+    shingles = set()
+    ordered = []
+    comparison = False
+    for token in TOKEN_PATTERN.findall(question.lower()):
+        if token in INTENT_WORDS:
+            intent.add(token)
+        elif token in COMPARISON_WORDS:
+            comparison = True
+        if token in STOPWORDS:
+            continue
+        if token.isdigit():
+            intent.add(str(int(token)))
+        elif any(ch.isdigit() for ch in token):
+            intent.add(token)
+        word = stem(token)
+        ordered.append(word)
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            shingles.add(padded[i:i + 3])
+    key = ' '.join(sorted(intent))
+    if comparison:
+        key += ' > ' + ' '.join(ordered)
+    return key, frozenset(shingles)
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class SimilarQuestions:
+    """MinHash/LSH index of answered questions so paraphrases reuse an answer
+
+    Each question's shingles get a MinHash signature that is split into
+    bands; questions sharing a band land in the same bucket. A lookup
+    verifies only the questions sharing at least two bands with it (at
+    most max_candidates, most shared first) with exact Jaccard similarity,
+    so its cost does not grow with the number stored. Entries are scoped (to the corpus version
+    and prompt settings) and bounded by LRU and TTL like the answer cache.
+    """
+
+    def __init__(self, threshold=0.8, max_entries=10000, ttl=3600, num_perm=64, bands=16, max_candidates=32,
+                 max_bucket=256, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_candidates = max_candidates
+        self.max_bucket = max_bucket
+        rng = random.Random(seed)
+        self._masks = [rng.getrandbits(HASH_BITS) for _ in range(num_perm)]
+        self._entries = OrderedDict()
+        self._buckets = {}
+        # (scope, shingles) -> entry id, so rephrasing the exact same words replaces the old entry
+        self._by_shingles = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'candidates': 0,
+            'stored': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.threshold <= 1.0
+
+    def signature(self, shingles):
+        hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+        # XOR with a fixed mask permutes the hash space; map keeps the inner loop in C
+        return [min(map(mask.__xor__, hashes)) for mask in self._masks]
+
+    def _band_keys(self, scope, signature):
+        rows = self.rows
+        return [(scope, band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(self.bands)]
+
+    def get(self, question, scope):
+        """Best stored answer for a similar question: {'question', 'answer', 'score'} or None"""
+        intent, shingles = question_features(question)
+        if not shingles:
+            return None
+        keys = self._band_keys((scope, intent), self.signature(shingles))
+        now = time.time()
+        with self._lock:
+            # Shared bands estimate the similarity; only the likeliest matches are checked exactly
+            shared = Counter()
+            for key in keys:
+                bucket = self._buckets.get(key, ())
+                # A band shared by that many questions says little, like a stopword
+                if len(bucket) <= self.max_bucket:
+                    shared.update(bucket)
+            # One shared band is likely by chance even for dissimilar questions
+            candidates = [entry_id for entry_id, count in shared.most_common(self.max_candidates) if count > 1]
+            self.counters['candidates'] += len(candidates)
+
+            best = None
+            best_score = self.threshold
+            size = len(shingles)
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry['expires_at'] <= now:
+                    self._remove(entry_id)
+                    self.counters['expirations'] += 1
+                    continue
+                other = len(entry['shingles'])
+                if min(size, other) < best_score * max(size, other):
+                    # Set sizes alone rule out beating the best match so far
+                    continue
+                score = jaccard(shingles, entry['shingles'])
+                # Ties go to the newer entry
+                if score > best_score or (score == best_score and (best is None or entry_id > best)):
+                    best, best_score = entry_id, score
+
+            if best is None:
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(best)
+            self.counters['hits'] += 1
+            entry = self._entries[best]
+            return {'question': entry['question'], 'answer': entry['answer'], 'score': round(best_score, 4)}
+
+    def put(self, question, scope, answer):
+        """Remember a freshly answered question"""
+        if not self.enabled:
+            return
+        intent, shingles = question_features(question)
+        if not shingles:
+            return
+        scope = (scope, intent)
+        keys = self._band_keys(scope, self.signature(shingles))
+        with self._lock:
+            previous = self._by_shingles.get((scope, shingles))
+            if previous is not None:
+                self._remove(previous)
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {
+                'question': question,
+                'scope': scope,
+                'shingles': shingles,
+                'answer': answer,
+                'keys': keys,
+                'expires_at': time.time() + self.ttl
+            }
+            self._by_shingles[(scope, shingles)] = entry_id
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            self.counters['stored'] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        if self._by_shingles.get((entry['scope'], entry['shingles'])) == entry_id:
+            del self._by_shingles[(entry['scope'], entry['shingles'])]
+        for key in entry['keys']:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            size = len(self._entries)
+            buckets = len(self._buckets)
+        lookups = counters['hits'] + counters['misses']
+        return {
+            **counters,
+            'size': size,
+            'buckets': buckets,
+            'max_entries': self.max_entries,
+            'threshold': self.threshold,
+            'hit_rate': round(counters['hits'] / lookups, 4) if lookups else 0.0,
+            'avg_candidates': round(counters['candidates'] / lookups, 2) if lookups else 0.0
+        }
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+
+class _Call:
+    """One in-flight call that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls into one
+
+    The first caller for a key runs the function; callers that arrive while
+    it is still running wait for it and share its result (or its error).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            'leaders': 0,
+            'coalesced': 0
+        }
+
+    def do(self, key, fn):
+        """Run fn once per key at a time; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.counters['coalesced'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.counters['leaders'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn):
+        """Event-loop version of do(); fn is a coroutine function"""
+        future = self._async_calls.get(key)
+        if future is not None:
+            with self._lock:
+                self.counters['coalesced'] += 1
+            # Shielded so one follower disconnecting does not cancel the shared call
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._async_calls[key] = future
+        with self._lock:
+            self.counters['leaders'] += 1
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._async_calls[key]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            in_flight = len(self._calls)
+        return {
+            **counters,
+            'in_flight': in_flight + len(self._async_calls)
+        }
@@ -0,0 +1,350 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections.abc import Sequence
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; concurrent workers may then build the same snapshot twice
+    fcntl = None
+
+from book_agent.corpus import BOOK_TITLE_HEADER, CorpusSnapshot
+from book_agent.retrieval import BM25Index
+from book_agent.suggestions import SuggestionIndex
+
+logger = logging.getLogger(__name__)
+
+# Bump when the file layout or the parsing/chunking it captures changes
+MAGIC = b'BKSNAP01'
+HEADER_LENGTH = struct.Struct('<Q')
+# Chunk table: byte offset and length of source, heading and text per chunk
+CHUNK_FIELDS = 6
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _decode(view, offset, length):
+    return str(view[offset:offset + length], 'utf-8')
+
+
+class MappedChunks(Sequence):
+    """Chunk dicts decoded on access from the mapped string section"""
+
+    def __init__(self, table, strings):
+        self._table = table
+        self._strings = strings
+
+    def __len__(self):
+        return len(self._table) // CHUNK_FIELDS
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        base = position * CHUNK_FIELDS
+        fields = self._table[base:base + CHUNK_FIELDS]
+        return {
+            'id': position,
+            'source': _decode(self._strings, fields[0], fields[1]),
+            'heading': _decode(self._strings, fields[2], fields[3]),
+            'text': _decode(self._strings, fields[4], fields[5])
+        }
+
+
+class MappedPostings:
+    """term -> (position, frequency) pairs read straight from the mapped postings array"""
+
+    def __init__(self, terms, pairs):
+        self._terms = terms
+        self._pairs = pairs
+
+    def __contains__(self, term):
+        return term in self._terms
+
+    def __len__(self):
+        return len(self._terms)
+
+    def get(self, term, default=None):
+        entry = self._terms.get(term)
+        if entry is None:
+            return default
+        start, end = entry[0] * 2, (entry[0] + entry[1]) * 2
+        return zip(self._pairs[start:end:2], self._pairs[start + 1:end:2])
+
+
+class MappedIdf:
+    def __init__(self, terms):
+        self._terms = terms
+
+    def __getitem__(self, term):
+        return self._terms[term][2]
+
+
+class MappedBM25Index(BM25Index):
+    """BM25Index whose postings, document lengths and chunks live in a mapped snapshot file"""
+
+    def __init__(self, chunks, terms, pairs, doc_lengths, avg_doc_length, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = MappedPostings(terms, pairs)
+        self.idf = MappedIdf(terms)
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = avg_doc_length
+        self.length_norms = self.compute_length_norms()
+
+
+class MappedCorpusSnapshot(CorpusSnapshot):
+    """CorpusSnapshot read from a memory-mapped snapshot file
+
+    Chunk texts, the combined book text and the retrieval postings stay in
+    the mapping, so every worker process on a host shares one copy through
+    the page cache. Only per-document metadata, the term dictionary and the
+    suggestion index are held as Python objects.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a corpus snapshot of this version")
+        (header_length,) = HEADER_LENGTH.unpack_from(view, len(MAGIC))
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(str(view[header_start:header_start + header_length], 'utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was written on a {header['byteorder']}-endian host")
+
+        data_start = _align(header_start + header_length)
+
+        def section(name, typecode=None):
+            offset, length = header['sections'][name]
+            part = view[data_start + offset:data_start + offset + length]
+            return part.cast(typecode) if typecode else part
+
+        self.path = path
+        self.key = header['key']
+        self.version = header['version']
+        self.manifest = {path: tuple(entry) for path, entry in header['manifest'].items()}
+        self.records = header['records']
+        self._book = section('book')
+        self._book_content = None
+        self.book_structure = {
+            'chapters': [{
+                'id': record['path'],
+                'title': record['title'],
+                'path': record['path'],
+                'directory': record['directory']
+            } for record in self.records],
+            'sections': [],
+            'topics': self._collect_topics(self.records)
+        }
+
+        chunks = MappedChunks(section('chunks', 'Q'), section('strings'))
+        bm25 = header['bm25']
+        self.index = MappedBM25Index(chunks, bm25['terms'], section('postings', 'I'), section('doc_lengths', 'I'),
+                                     bm25['avg_doc_length'], bm25['k1'], bm25['b'])
+        suggestions = header['suggestions']
+        self.suggestions = SuggestionIndex(suggestions['entries'], suggestions['postings'], suggestions['lengths'])
+        self._chunk_terms = None
+
+    @property
+    def book_content(self):
+        # Only the full-content prompt mode needs the whole book as one string
+        if self._book_content is None:
+            self._book_content = str(self._book, 'utf-8')
+        return self._book_content
+
+    def chunk_terms(self):
+        """Per-chunk (term, frequency) pairs, recovered from the postings rather than by tokenizing again"""
+        if self._chunk_terms is None:
+            terms = [[] for _ in range(len(self.index.chunks))]
+            postings = self.index.postings
+            for term in postings._terms:
+                for position, frequency in postings.get(term):
+                    terms[position].append((term, frequency))
+            self._chunk_terms = terms
+        return self._chunk_terms
+
+    def parsed_record(self, record):
+        """A record with its body and chunks, as parse_doc returns it"""
+        first, count = record['chunk_range']
+        terms = self.chunk_terms()
+        chunks = [dict(chunk, terms=terms[chunk['id']]) for chunk in self.index.chunks[first:first + count]]
+        return dict(record, body=_decode(self._book, *record['body_span']), chunks=chunks)
+
+
+def write_snapshot(path, key, snapshot, manifest):
+    """Serialize an in-memory CorpusSnapshot built from parsed records"""
+    book = bytearray()
+    strings = bytearray()
+    chunk_table = array('Q')
+
+    def put(buffer, text):
+        data = text.encode('utf-8')
+        offset = len(buffer)
+        buffer += data
+        return offset, len(data)
+
+    put(book, BOOK_TITLE_HEADER)
+    records = []
+    first_chunk = 0
+    for record in snapshot.records:
+        put(book, f"\n\n## From {record['name']}\n\n")
+        meta = {name: value for name, value in record.items() if name not in ('body', 'chunks')}
+        meta['body_span'] = put(book, record['body'])
+        meta['chunk_range'] = (first_chunk, len(record['chunks']))
+        first_chunk += len(record['chunks'])
+        records.append(meta)
+
+    for chunk in snapshot.index.chunks:
+        for field in ('source', 'heading', 'text'):
+            chunk_table.extend(put(strings, chunk[field]))
+
+    # Postings are stored per term as consecutive (position, frequency) pairs
+    index = snapshot.index
+    pairs = array('I')
+    terms = {}
+    for term, postings in index.postings.items():
+        terms[term] = (len(pairs) // 2, len(postings), index.idf[term])
+        for position, frequency in postings:
+            pairs.append(position)
+            pairs.append(frequency)
+    doc_lengths = array('I', index.doc_lengths)
+
+    sections = {}
+    blobs = []
+    offset = 0
+    for name, blob in [('book', book), ('strings', strings), ('chunks', chunk_table.tobytes()),
+                       ('postings', pairs.tobytes()), ('doc_lengths', doc_lengths.tobytes())]:
+        sections[name] = (offset, len(blob))
+        padded = _align(len(blob))
+        blobs.append(bytes(blob) + b'\0' * (padded - len(blob)))
+        offset += padded
+
+    header = json.dumps({
+        'key': key,
+        'version': snapshot.version,
+        'byteorder': sys.byteorder,
+        'manifest': manifest,
+        'records': records,
+        'bm25': {'k1': index.k1, 'b': index.b, 'avg_doc_length': index.avg_doc_length, 'terms': terms},
+        'suggestions': {
+            'entries': snapshot.suggestions.entries,
+            'postings': snapshot.suggestions.postings,
+            'lengths': snapshot.suggestions.lengths
+        },
+        'sections': sections
+    }, separators=(',', ':')).encode('utf-8')
+    header_start = len(MAGIC) + HEADER_LENGTH.size
+    padding = _align(header_start + len(header)) - header_start - len(header)
+
+    # Written beside the target and renamed into place, so readers never see a partial file
+    fd, temporary = tempfile.mkstemp(dir=Path(path).parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            f.write(b'\0' * padding)
+            for blob in blobs:
+                f.write(blob)
+        # mkstemp creates owner-only files; workers may run as another user
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
+
+
+class SnapshotStore:
+    """Directory of memory-mappable corpus snapshots keyed by the docs manifest
+
+    Worker processes that start against the same docs tree map the same
+    file instead of each parsing the docs. The key only covers the path,
+    mtime and size of every file, so checking for a usable snapshot does
+    not read any markdown.
+    """
+
+    def __init__(self, directory, docs_path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Several docs trees can share a directory
+        self.prefix = 'corpus-' + hashlib.sha1(str(Path(docs_path).resolve()).encode('utf-8')).hexdigest()[:8]
+        self.counters = {
+            'opened': 0,
+            'built': 0,
+            'invalid': 0
+        }
+
+    @staticmethod
+    def manifest_key(entries):
+        """Hash of DocsCorpus.scan() output"""
+        material = '\n'.join(f"{path}:{mtime_ns}:{size}" for path, (_, mtime_ns, size) in sorted(entries.items()))
+        return hashlib.sha1(MAGIC + material.encode('utf-8')).hexdigest()[:16]
+
+    def path(self, key):
+        return self.directory / f"{self.prefix}-{key}.snap"
+
+    def open(self, key):
+        """Map the snapshot for key; None when there is none or it cannot be used"""
+        path = self.path(key)
+        if not path.exists():
+            return None
+        try:
+            snapshot = MappedCorpusSnapshot(path)
+        except (OSError, ValueError, KeyError) as e:
+            self.counters['invalid'] += 1
+            logger.warning(f"Ignoring corpus snapshot {path.name}: {str(e)}")
+            return None
+        self.counters['opened'] += 1
+        return snapshot
+
+    @contextmanager
+    def building(self, key):
+        """Hold the store's build lock so only one process builds a snapshot at a time"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.directory / f"{self.prefix}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def save(self, key, snapshot, manifest):
+        """Write a freshly built snapshot, drop older ones and return the mapped copy"""
+        path = self.path(key)
+        write_snapshot(path, key, snapshot, manifest)
+        self.counters['built'] += 1
+        # Workers still mapping an old file keep reading it until they switch
+        for old in self.directory.glob(f"{self.prefix}-*.snap"):
+            if old != path:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+        return MappedCorpusSnapshot(path)
+
+    def stats(self):
+        return {
+            'directory': str(self.directory),
+            **self.counters
+        }
@@ -0,0 +1,157 @@
+import heapq
+import math
+from bisect import bisect_left
+
+from book_agent.retrieval import STOPWORDS, TOKEN_PATTERN, tokenize
+
+# Score multipliers by how a query term matched an indexed term
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.7
+FUZZY_WEIGHT = 0.5
+
+# Small preference between entry kinds when scores tie
+KIND_WEIGHTS = {
+    'chapter': 1.1,
+    'topic': 1.0,
+    'section': 0.9
+}
+
+# Entries taken per matched term; postings are ranked best first
+MAX_POSTINGS_PER_TERM = 64
+
+
+def _deletes(term):
+    """All strings one deletion away from term"""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+class SuggestionIndex:
+    """Inverted index over chapter titles, topics and section headings
+
+    Query terms are stemmed and matched exactly, by prefix (for the word
+    being typed) or within one edit using a deletion neighbourhood. Each
+    term's postings are ranked by entry weight, and a lookup only takes the
+    first MAX_POSTINGS_PER_TERM of each matching term as candidates, so its
+    cost stays flat however many entries are indexed. Candidates are then
+    scored against all matching terms, so an entry found through one term
+    still gets credit for the others.
+    """
+
+    def __init__(self, entries, postings=None, lengths=None):
+        self.entries = entries
+        # Postings and lengths can come precomputed from a stored corpus snapshot
+        self.postings = postings
+        self.lengths = lengths
+        if postings is None:
+            self.postings = {}
+            self.lengths = []
+            for position, entry in enumerate(entries):
+                terms = tokenize(entry['text'])
+                self.lengths.append(len(terms) or 1)
+                for term in set(terms):
+                    self.postings.setdefault(term, []).append(position)
+
+        # Kind preference and length penalty, the part of an entry's score that doesn't depend on the query
+        self.weights = [KIND_WEIGHTS[entry['kind']] / math.sqrt(length) for entry, length in zip(entries, self.lengths)]
+        self.entry_terms = [[] for _ in entries]
+        for term, ids in self.postings.items():
+            ids.sort(key=lambda position: (-self.weights[position], position))
+            for position in ids:
+                self.entry_terms[position].append(term)
+
+        total = len(entries) or 1
+        self.idf = {term: math.log(1 + total / len(ids)) for term, ids in self.postings.items()}
+        self.vocabulary = sorted(self.postings)
+
+        # Deletion neighbourhood for typo-tolerant lookup (SymSpell style)
+        self.deletes = {}
+        for term in self.vocabulary:
+            if len(term) >= 4:
+                for variant in _deletes(term):
+                    self.deletes.setdefault(variant, set()).add(term)
+
+    @classmethod
+    def from_records(cls, records, structure):
+        """Build the index from parsed docs and their structure"""
+        entries = []
+        for chapter in structure['chapters']:
+            entries.append({'text': chapter['title'], 'kind': 'chapter', 'path': chapter['path']})
+
+        topic_paths = {}
+        for record in records:
+            for level, text in record['headings']:
+                if level == 2:
+                    topic_paths.setdefault(text, record['path'])
+                elif level >= 3:
+                    entries.append({'text': text, 'kind': 'section', 'path': record['path']})
+        for topic in structure['topics']:
+            entries.append({'text': topic, 'kind': 'topic', 'path': topic_paths.get(topic)})
+        return cls(entries)
+
+    def expand(self, term, partial=False):
+        """Indexed terms matching a query term, with match weights"""
+        matches = {}
+        if term in self.postings:
+            matches[term] = EXACT_WEIGHT
+
+        if partial:
+            start = bisect_left(self.vocabulary, term)
+            for candidate in self.vocabulary[start:start + 20]:
+                if not candidate.startswith(term):
+                    break
+                matches.setdefault(candidate, PREFIX_WEIGHT)
+
+        if not matches and len(term) >= 4:
+            candidates = set(self.deletes.get(term, ()))
+            for variant in _deletes(term):
+                if variant in self.postings:
+                    candidates.add(variant)
+                candidates.update(self.deletes.get(variant, ()))
+            for candidate in candidates:
+                matches.setdefault(candidate, FUZZY_WEIGHT)
+        return matches
+
+    def search(self, query, limit=5, kinds=None, partial=True):
+        """Rank entries for a free-text query
+
+        With partial=True the last word is also prefix-matched, for queries
+        that are still being typed.
+        """
+        words = TOKEN_PATTERN.findall(query.lower())
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        # The last word may still be being typed
+        partial_word = None
+        if partial and words and not query[-1:].isspace() and words[-1] not in STOPWORDS:
+            partial_word = words[-1]
+
+        # Indexed term -> what an entry containing it scores, summed over the query terms it matched
+        term_scores = {}
+        candidates = set()
+        for index, term in enumerate(terms):
+            typing = partial_word is not None and index == len(terms) - 1
+            matches = self.expand(term, typing)
+            if typing and partial_word != term:
+                for candidate, weight in self.expand(partial_word, True).items():
+                    matches.setdefault(candidate, weight)
+            for candidate, weight in matches.items():
+                term_scores[candidate] = term_scores.get(candidate, 0.0) + weight * self.idf[candidate]
+                taken = 0
+                for position in self.postings[candidate]:
+                    if kinds and self.entries[position]['kind'] not in kinds:
+                        continue
+                    candidates.add(position)
+                    taken += 1
+                    if taken == MAX_POSTINGS_PER_TERM:
+                        break
+
+        def score(position):
+            # Prefer short entries where the query covers more of the text
+            matched = sum(term_scores.get(term, 0.0) for term in self.entry_terms[position])
+            return matched * self.weights[position]
+
+        ranked = heapq.nlargest(limit, ((score(position), position) for position in candidates),
+                                key=lambda item: (item[0], -item[1]))
+        return [dict(self.entries[position], score=round(score, 4)) for score, position in ranked]
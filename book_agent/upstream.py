@@ -0,0 +1,503 @@
+import asyncio
+import json
+import logging
+import random
+import socket
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import httpx
+except ImportError:  # Only needed by the async serving mode
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Timing of the request currently running on this thread
+_request_timing = threading.local()
+# Guards which request owns a connection while a CancelToken may abort it
+_cancel_lock = threading.Lock()
+
+
+class Cancelled(Exception):
+    """The request was abandoned through its CancelToken"""
+
+
+class CancelToken:
+    """Lets another thread abort a blocking request, e.g. once a hedged request has been answered
+
+    Cancelling shuts down the socket the request is waiting on, which
+    wakes the blocked read. A connection already handed to another
+    request is left alone.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._connection = None
+
+    def _attach(self, connection):
+        with _cancel_lock:
+            if self._connection is not None and self._connection is not connection:
+                self._connection.cancel_token = None
+            self._connection = connection
+
+    def _detach(self):
+        with _cancel_lock:
+            if self._connection is not None and getattr(self._connection, 'cancel_token', None) is self:
+                self._connection.cancel_token = None
+            self._connection = None
+
+    def cancel(self):
+        with _cancel_lock:
+            self.cancelled = True
+            connection = self._connection
+            if connection is None or getattr(connection, 'cancel_token', None) is not self or connection.sock is None:
+                return
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def _current_timing():
+    return getattr(_request_timing, 'timing', None)
+
+
+def _timed_connect(connection, connect):
+    """Run a connection's connect() while recording DNS and connect time"""
+    timing = _current_timing()
+    if timing is None:
+        return connect()
+
+    started = time.perf_counter()
+    try:
+        # Resolve up front so DNS time can be reported separately from TCP/TLS setup
+        socket.getaddrinfo(connection._dns_host, connection.port, 0, socket.SOCK_STREAM)
+    except OSError:
+        pass
+    resolved = time.perf_counter()
+    timing['dns_ms'] = round((resolved - started) * 1000, 2)
+    try:
+        return connect()
+    finally:
+        timing['connect_ms'] = round((time.perf_counter() - resolved) * 1000, 2)
+        timing['new_connection'] = True
+
+
+def _owned_request(connection, request, args, kwargs):
+    """Send a request on a connection, making it the one the thread's CancelToken aborts"""
+    token = getattr(_request_timing, 'cancel', None)
+    with _cancel_lock:
+        connection.cancel_token = token
+    if token is not None:
+        token._attach(connection)
+    return request(*args, **kwargs)
+
+
+class TimedHTTPConnection(HTTPConnection):
+    cancel_token = None
+
+    def connect(self):
+        return _timed_connect(self, super().connect)
+
+    def request(self, *args, **kwargs):
+        return _owned_request(self, super().request, args, kwargs)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    cancel_token = None
+
+    def connect(self):
+        return _timed_connect(self, super().connect)
+
+    def request(self, *args, **kwargs):
+        return _owned_request(self, super().request, args, kwargs)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Pooled adapter whose connections report their setup time"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool
+        }
+
+
+def parse_stream_line(line):
+    """Content deltas in one line of a streamed completion, or None at the end"""
+    if not line or not line.startswith('data:'):
+        return []
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return None
+    try:
+        event = json.loads(data)
+    except ValueError:
+        logger.warning(f"Skipping malformed stream event: {data[:80]}")
+        return []
+    deltas = []
+    for choice in event.get('choices') or []:
+        text = (choice.get('delta') or {}).get('content')
+        if text:
+            deltas.append(text)
+    return deltas
+
+
+def body_argument(payload, raw_name):
+    """Keyword argument for a request body: raw JSON bytes as-is, anything else JSON-encoded"""
+    if isinstance(payload, bytes):
+        return {raw_name: payload}
+    return {'json': payload}
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class BaseUpstreamClient:
+    """Retry policy and timing statistics shared by the sync and async clients"""
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, url, pool_size=16, connect_timeout=5.0, read_timeout=60.0,
+                 max_retries=2, backoff_base=0.5, backoff_max=8.0, max_retry_after=30.0, metrics=None,
+                 name='default'):
+        self.url = url
+        self.name = name
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        # Called with the Retry-After seconds (or None) whenever the upstream answers 429
+        self.on_rate_limited = None
+        self.metrics = metrics
+        if metrics is not None:
+            self._responses_metric = metrics.counter(
+                'upstream_responses_total', 'Upstream HTTP responses by status code, retried attempts included',
+                ('provider', 'status'))
+            self._duration_metric = metrics.histogram(
+                'upstream_request_duration_seconds', 'Upstream calls including retries, until response headers',
+                ('provider', 'outcome'))
+            self._ttfb_metric = metrics.histogram(
+                'upstream_ttfb_seconds', 'Time to first byte of the last upstream attempt', ('provider',))
+            self._in_flight_metric = metrics.gauge(
+                'upstream_requests_in_flight', 'Upstream calls in progress, retries and backoff included')
+
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=200)
+        self.counters = {
+            'requests': 0,
+            'attempts': 0,
+            'retries': 0,
+            'failures': 0,
+            'cancelled': 0,
+            'new_connections': 0
+        }
+
+    def settings(self):
+        """Constructor arguments, so a sibling client can share the configuration"""
+        return {
+            'url': self.url,
+            'pool_size': self.pool_size,
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'max_retries': self.max_retries,
+            'backoff_base': self.backoff_base,
+            'backoff_max': self.backoff_max,
+            'max_retry_after': self.max_retry_after,
+            'metrics': self.metrics,
+            'name': self.name
+        }
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_delay(self, status_code, headers, attempt):
+        """Seconds to wait before retrying a response, or None to stop"""
+        retry_after = parse_retry_after(headers.get('Retry-After')) if status_code == 429 else None
+        if status_code == 429 and self.on_rate_limited is not None:
+            self.on_rate_limited(retry_after)
+        if attempt >= self.max_retries:
+            return None
+        if status_code == 429:
+            if retry_after is None:
+                return self.backoff_delay(attempt)
+            # Waiting longer than this would only hold the worker hostage
+            return retry_after if retry_after <= self.max_retry_after else None
+        if status_code in self.RETRY_STATUSES:
+            return self.backoff_delay(attempt)
+        return None
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _observe_attempt(self, status):
+        """Count one attempt by status code ('error' for transport failures)"""
+        if self.metrics is not None:
+            self._responses_metric.inc(provider=self.name, status=status)
+
+    def _in_flight(self, amount):
+        if self.metrics is not None:
+            self._in_flight_metric.inc(amount)
+
+    def _record(self, timing):
+        """Keep the timing for monitoring"""
+        if self.metrics is not None:
+            self._duration_metric.observe(timing['total_ms'] / 1000, provider=self.name,
+                                          outcome=timing.get('status', 'error'))
+            if 'ttfb_ms' in timing:
+                self._ttfb_metric.observe(timing['ttfb_ms'] / 1000, provider=self.name)
+        with self._lock:
+            self.counters['attempts'] += timing['attempts']
+            if timing.get('new_connection'):
+                self.counters['new_connections'] += 1
+            self._recent.append(timing)
+
+    def stats(self):
+        """Counters plus average timings over recent requests"""
+        with self._lock:
+            recent = list(self._recent)
+            counters = dict(self.counters)
+
+        def average(field):
+            values = [t[field] for t in recent if field in t]
+            return round(sum(values) / len(values), 2) if values else None
+
+        return {
+            'url': self.url,
+            'counters': counters,
+            'recent_requests': len(recent),
+            'avg_ms': {
+                'dns': average('dns_ms'),
+                'connect': average('connect_ms'),
+                'ttfb': average('ttfb_ms'),
+                'total': average('total_ms')
+            },
+            'last': recent[-1] if recent else None
+        }
+
+
+class UpstreamClient(BaseUpstreamClient):
+    """Keep-alive HTTP client for the LLM endpoint with timeouts and retries"""
+
+    def __init__(self, url, **kwargs):
+        super().__init__(url, **kwargs)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+
+        self.session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post_json(self, payload, headers=None, cancel=None):
+        """POST a JSON payload (dict or encoded bytes) and return the decoded response body
+
+        With a CancelToken, cancelling it from another thread makes this
+        raise Cancelled instead of waiting for the upstream.
+        """
+        response = self.post(payload, headers, cancel=cancel)
+        try:
+            return response.json()
+        finally:
+            response.close()
+
+    def stream_chat(self, payload, headers=None):
+        """POST a streaming chat completion and yield content deltas as they arrive
+
+        Retries only happen before the first byte; once tokens have been
+        forwarded to the client the stream cannot be replayed.
+        """
+        response = self.post(payload, headers, stream=True)
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                deltas = parse_stream_line(line)
+                if deltas is None:
+                    break
+                yield from deltas
+        finally:
+            response.close()
+
+    def post(self, payload, headers=None, stream=False, cancel=None):
+        """POST with bounded retries; raises requests exceptions once retries run out"""
+        timing = {'attempts': 0}
+        started = time.perf_counter()
+        self._count('requests')
+        self._in_flight(1)
+
+        try:
+            attempt = 0
+            while True:
+                if cancel is not None and cancel.cancelled:
+                    raise Cancelled()
+                timing['attempts'] += 1
+                _request_timing.timing = timing
+                _request_timing.cancel = cancel
+                try:
+                    response = self.session.post(self.url, headers=headers, timeout=self.timeout,
+                                                 stream=stream, **body_argument(payload, 'data'))
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                    if cancel is not None and cancel.cancelled:
+                        raise Cancelled() from e
+                    self._observe_attempt('error')
+                    if isinstance(e, requests.exceptions.ReadTimeout) or attempt >= self.max_retries:
+                        raise
+                    delay = self.backoff_delay(attempt)
+                    logger.warning(f"Upstream connection error ({str(e)}), retrying in {delay:.2f}s")
+                else:
+                    timing['ttfb_ms'] = round(response.elapsed.total_seconds() * 1000, 2)
+                    timing['status'] = response.status_code
+                    self._observe_attempt(response.status_code)
+                    delay = self._retry_delay(response.status_code, response.headers, attempt)
+                    if delay is None:
+                        if response.status_code >= 400:
+                            response.close()
+                            response.raise_for_status()
+                        response.upstream_timing = timing
+                        return response
+                    response.close()
+                    logger.warning(f"Upstream returned {response.status_code}, retrying in {delay:.2f}s")
+                finally:
+                    _request_timing.timing = None
+                    _request_timing.cancel = None
+                    if cancel is not None:
+                        cancel._detach()
+
+                self._count('retries')
+                time.sleep(delay)
+                attempt += 1
+        except Cancelled:
+            self._count('cancelled')
+            raise
+        except Exception:
+            self._count('failures')
+            raise
+        finally:
+            timing['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            self._in_flight(-1)
+            self._record(timing)
+
+
+class AsyncUpstreamClient(BaseUpstreamClient):
+    """Non-blocking counterpart of UpstreamClient built on httpx"""
+
+    def __init__(self, url, **kwargs):
+        if httpx is None:
+            raise RuntimeError("The async serving mode requires httpx (pip install httpx)")
+        super().__init__(url, **kwargs)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def post_json(self, payload, headers=None):
+        """POST a JSON payload and return the decoded response body"""
+        response = await self.post(payload, headers)
+        try:
+            await response.aread()
+            return response.json()
+        finally:
+            await response.aclose()
+
+    async def stream_chat(self, payload, headers=None):
+        """POST a streaming chat completion and yield content deltas as they arrive"""
+        response = await self.post(payload, headers)
+        try:
+            async for line in response.aiter_lines():
+                deltas = parse_stream_line(line)
+                if deltas is None:
+                    break
+                for text in deltas:
+                    yield text
+        finally:
+            await response.aclose()
+
+    async def post(self, payload, headers=None):
+        """POST with bounded retries; the returned response body is not read yet"""
+        timing = {'attempts': 0}
+        started = time.perf_counter()
+        self._count('requests')
+        self._in_flight(1)
+
+        async def trace(event, info):
+            # httpx reports connection setup through the "trace" request extension
+            if event == 'connection.connect_tcp.started':
+                timing['_connect_started'] = time.perf_counter()
+                timing['new_connection'] = True
+            elif event in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+                if '_connect_started' in timing:
+                    timing['connect_ms'] = round((time.perf_counter() - timing['_connect_started']) * 1000, 2)
+        try:
+            attempt = 0
+            while True:
+                timing['attempts'] += 1
+                request = self.client.build_request('POST', self.url, headers=headers,
+                                                    extensions={'trace': trace},
+                                                    **body_argument(payload, 'content'))
+                sent = time.perf_counter()
+                try:
+                    response = await self.client.send(request, stream=True)
+                except httpx.TransportError as e:
+                    self._observe_attempt('error')
+                    if isinstance(e, httpx.ReadTimeout) or attempt >= self.max_retries:
+                        raise
+                    delay = self.backoff_delay(attempt)
+                    logger.warning(f"Upstream connection error ({str(e)}), retrying in {delay:.2f}s")
+                else:
+                    timing['ttfb_ms'] = round((time.perf_counter() - sent) * 1000, 2)
+                    timing['status'] = response.status_code
+                    self._observe_attempt(response.status_code)
+                    delay = self._retry_delay(response.status_code, response.headers, attempt)
+                    if delay is None:
+                        if response.status_code >= 400:
+                            await response.aclose()
+                            response.raise_for_status()
+                        return response
+                    await response.aclose()
+                    logger.warning(f"Upstream returned {response.status_code}, retrying in {delay:.2f}s")
+
+                self._count('retries')
+                await asyncio.sleep(delay)
+                attempt += 1
+        except Exception:
+            self._count('failures')
+            raise
+        finally:
+            timing.pop('_connect_started', None)
+            timing['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            self._in_flight(-1)
+            self._record(timing)
@@ -1,12 +1,34 @@
 import os
 import sys
 import json
+import hashlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, jsonify, send_file, send_from_directory, request
+from flask import Flask, Response, g, jsonify, send_file, send_from_directory, request
+from werkzeug.utils import safe_join
 import requests
 from dotenv import load_dotenv
+from book_agent.cache import AnswerCache, make_cache_key, normalize_question
+from book_agent.conversations import ConversationStore, normalize_conversation_id
+from book_agent.corpus import DocsCorpus
+from book_agent.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from book_agent.metrics import SIZE_BUCKETS, TOKEN_BUCKETS, MetricsRegistry
+from book_agent.profiler import SamplingProfiler
+from book_agent.prompts import SUMMARY_PROMPT, PromptBuilder
+from book_agent.limiter import RateLimiter
+from book_agent.memory import ConversationMemory, render_turns
+from book_agent.providers import Provider, ProviderRouter, configured_providers
+from book_agent.responses import FileHashes, PayloadCache
+from book_agent.retrieval import estimate_tokens, format_chunks
+from book_agent.similar import SimilarQuestions
+from book_agent.singleflight import SingleFlight
+from book_agent.snapshots import SnapshotStore
+from book_agent.sse import sse_event
+from book_agent.upstream import UpstreamClient
 
 # Load environment variables
 load_dotenv()
@@ -15,18 +37,158 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Completion budget per answer; also what the rate limiter reserves for the reply
+MAX_COMPLETION_TOKENS = 1000
+
+# Returned when the docs directory cannot be read
+DEFAULT_BOOK_CONTENT = """# Physical AI: Human-Robot Artificial Intelligence
+
+## Chapter 1: Introduction to Physical AI
+Physical AI refers to the integration of artificial intelligence with physical systems, particularly robots. It involves AI algorithms that control, sense, and interact with the physical world.
+
+## Chapter 2: Hardware Components in Physical AI Systems
+Physical AI systems require specialized hardware including sensors, actuators, and computing units that can operate in real-time environments.
+
+## Chapter 3: Sensors and Perception in Physical AI
+Sensory perception is crucial for Physical AI systems. Common sensors include cameras, LIDAR, ultrasonic sensors, and IMUs that provide environmental awareness.
+
+## Chapter 4: Human-Robot Interaction in Physical AI
+Effective human-robot interaction requires intuitive interfaces, safety mechanisms, and responsive behaviors that align with human expectations.
+
+## Chapter 5: Machine Learning in Physical AI Systems
+Machine learning algorithms enable Physical AI systems to adapt to new situations, learn from experience, and improve performance over time.
+"""
+
 class BookSiteAIAgent:
     def __init__(self):
-        self.app = Flask(__name__)
+        # /static/ is served from ai-chatbot below, not from Flask's default static folder
+        self.app = Flask(__name__, static_folder=None)
         self.port = int(os.getenv('PORT', 3002))
         self.api_key = None
-        self.book_content = ''
-        self.book_structure = {}
-        self.conversation_history = []
+        self.corpus = None
+        # Conversation history: newest entries in memory, optionally all of it in SQLite
+        self.conversations = ConversationStore(
+            max_entries=int(os.getenv('CONVERSATION_RETENTION', 50)),
+            db_path=os.getenv('CONVERSATION_DB')
+        )
+        self.async_app = None
+        # Prometheus-style metrics served at /metrics
+        self.metrics = MetricsRegistry()
+        # Sampling profiler, switched on at runtime through /api/agent/profile
+        self.profiler = SamplingProfiler()
+        self.profiler_endpoint = os.getenv('PROFILER_ENDPOINT', 'false').lower() in ('1', 'true', 'yes')
+
+        docs_path = os.getenv('BOOK_DOCS_PATH') or Path(__file__).parent / 'book' / 'book-site' / 'docs'
+        # Workers sharing CORPUS_SNAPSHOT_DIR map one parsed copy of the docs instead of each parsing them
+        snapshot_dir = os.getenv('CORPUS_SNAPSHOT_DIR')
+        self.docs_corpus = DocsCorpus(docs_path, fallback_content=DEFAULT_BOOK_CONTENT,
+                                      store=SnapshotStore(snapshot_dir, docs_path) if snapshot_dir else None)
+        # Seconds between checks for edited docs; 0 disables hot reload
+        self.docs_reload_interval = float(os.getenv('DOCS_RELOAD_INTERVAL', 5))
+
+        # Every provider with an API key gets its own client; <NAME>_API_URL points one at a local stub
+        upstream_settings = {
+            # One pooled keep-alive connection per worker thread
+            'pool_size': int(os.getenv('UPSTREAM_POOL_SIZE', 16)),
+            'connect_timeout': float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 5)),
+            'read_timeout': float(os.getenv('UPSTREAM_READ_TIMEOUT', 60)),
+            'max_retries': int(os.getenv('UPSTREAM_MAX_RETRIES', 2)),
+            'backoff_base': float(os.getenv('UPSTREAM_BACKOFF_BASE', 0.5)),
+            'max_retry_after': float(os.getenv('UPSTREAM_MAX_RETRY_AFTER', 30)),
+            'metrics': self.metrics
+        }
+        # Quotas are per provider: <NAME>_RPM / <NAME>_TPM override UPSTREAM_RPM / UPSTREAM_TPM (0 = unlimited)
+        def rate_limiter(name):
+            return RateLimiter(
+                rpm=int(os.getenv(f'{name.upper()}_RPM', os.getenv('UPSTREAM_RPM', 0))),
+                tpm=int(os.getenv(f'{name.upper()}_TPM', os.getenv('UPSTREAM_TPM', 0))),
+                max_queue=int(os.getenv('UPSTREAM_LIMIT_QUEUE', 256)),
+                max_wait=float(os.getenv('UPSTREAM_LIMIT_WAIT', 30))
+            )
+
+        providers = [
+            Provider(name, url, api_key, model, UpstreamClient(url, name=name, **upstream_settings),
+                     window_size=int(os.getenv('UPSTREAM_WINDOW_SIZE', 100)),
+                     window_seconds=float(os.getenv('UPSTREAM_WINDOW_SECONDS', 300)),
+                     limiter=rate_limiter(name))
+            for name, _, api_key, url, model in configured_providers()
+        ]
+        # Requests go to the fastest healthy provider and fail over to the others
+        self.router = ProviderRouter(
+            providers,
+            hedge=os.getenv('UPSTREAM_HEDGE', 'false').lower() in ('1', 'true', 'yes'),
+            hedge_min_delay=float(os.getenv('UPSTREAM_HEDGE_MIN_DELAY', 0.05)),
+            hedge_max_delay=float(os.getenv('UPSTREAM_HEDGE_MAX_DELAY', 5)),
+            hedge_ratio=float(os.getenv('UPSTREAM_HEDGE_RATIO', 0.1)),
+            max_error_rate=float(os.getenv('UPSTREAM_MAX_ERROR_RATE', 0.5)),
+            cooldown=float(os.getenv('UPSTREAM_EJECT_COOLDOWN', 30)),
+            metrics=self.metrics
+        ) if providers else None
+        # The first provider found, as before multi-provider routing
+        self.upstream = providers[0].client if providers else None
+        self.ai_api_url = providers[0].url if providers else None
+        self.ai_model = providers[0].model if providers else None
+
+        # Retrieval settings: only the best matching chunks go into the prompt
+        self.retrieval_top_k = int(os.getenv('RETRIEVAL_TOP_K', 5))
+        self.retrieval_token_budget = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', 2000))
+        # Set RETRIEVAL_FULL_CONTENT=true to send the whole book again (A/B testing)
+        self.retrieval_full_content = os.getenv('RETRIEVAL_FULL_CONTENT', 'false').lower() in ('1', 'true', 'yes')
+
+        # Answer cache: in-process LRU with TTL, plus an optional SQLite file that survives restarts
+        self.answer_cache = AnswerCache(
+            max_entries=int(os.getenv('ANSWER_CACHE_SIZE', 512)),
+            ttl=float(os.getenv('ANSWER_CACHE_TTL', 3600)),
+            db_path=os.getenv('ANSWER_CACHE_DB')
+        )
+        # Paraphrases of answered questions reuse the answer when similar enough (part of answer caching)
+        self.similar_questions = SimilarQuestions(
+            threshold=float(os.getenv('SIMILAR_QUESTION_THRESHOLD', 0.8)),
+            max_entries=int(os.getenv('SIMILAR_QUESTION_CACHE_SIZE', 10000)),
+            ttl=self.answer_cache.ttl
+        )
+        # System prompt prefix is rendered and encoded once per corpus version
+        self.prompt_builder = PromptBuilder(full_content=self.retrieval_full_content)
+        # Anything besides the corpus that changes what the model would answer
+        self.prompt_fingerprint = hashlib.sha1('\n'.join([
+            self.prompt_builder.fingerprint_material(),
+            ','.join(sorted(provider.model for provider in providers)),
+            str(self.retrieval_top_k),
+            str(self.retrieval_token_budget),
+            str(self.retrieval_full_content)
+        ]).encode('utf-8')).hexdigest()[:16]
+        
+        # Identical questions in flight at the same time share one upstream call
+        self.inflight = SingleFlight()
+
+        # Follow-up questions see their conversation's recent turns and a running summary of older ones
+        summarize = os.getenv('CONVERSATION_SUMMARIZE', 'true').lower() in ('1', 'true', 'yes')
+        self.conversation_memory = ConversationMemory(
+            max_turns=int(os.getenv('CONVERSATION_MEMORY_TURNS', 4)),
+            token_budget=int(os.getenv('CONVERSATION_MEMORY_TOKENS', 1500)),
+            summary_tokens=int(os.getenv('CONVERSATION_SUMMARY_TOKENS', 300)),
+            max_conversations=int(os.getenv('CONVERSATION_MEMORY_MAX', 1000)),
+            idle_ttl=float(os.getenv('CONVERSATION_MEMORY_IDLE', 1800)),
+            summarize=self.summarize_conversation if summarize else None
+        )
+
+        # Batch endpoint: distinct questions are answered in parallel on a shared pool
+        self.batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', 4))
+        self.batch_max_questions = int(os.getenv('BATCH_MAX_QUESTIONS', 500))
+        self.batch_executor = ThreadPoolExecutor(max_workers=self.batch_concurrency, thread_name_prefix='batch')
         
+        # Book info and structure are serialized and compressed once per corpus version
+        self.payloads = PayloadCache()
+        # Static assets are cached by browsers and revalidated by content hash
+        self.static_max_age = int(os.getenv('STATIC_MAX_AGE', 86400))
+        self.static_hashes = FileHashes()
+        self.static_dir = Path(__file__).parent / 'ai-chatbot'
+
         # Configure additional Flask settings
-        self.app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable cache in debug
+        self.app.config['SEND_FILE_MAX_AGE_DEFAULT'] = self.static_max_age
         
+        self.setup_metrics()
+
         # Initialize services
         self.initialize_services()
         
@@ -36,21 +198,75 @@ class BookSiteAIAgent:
         # Setup error handlers
         self.setup_error_handlers()
 
+    def setup_metrics(self):
+        """Register the agent's metrics and the per-route request hooks"""
+        metrics = self.metrics
+        self.request_metric = metrics.counter(
+            'http_requests_total', 'HTTP requests by route, method and status', ('route', 'method', 'status'))
+        self.request_latency_metric = metrics.histogram(
+            'http_request_duration_seconds', 'Time until the response is returned; streamed bodies are not included',
+            ('route', 'method'))
+        self.requests_in_flight_metric = metrics.gauge('http_requests_in_flight', 'HTTP requests being handled')
+        self.stage_metric = metrics.histogram(
+            'agent_stage_duration_seconds', 'Time spent in each stage of answering a question', ('stage',))
+        self.answers_metric = metrics.counter(
+            'agent_answers_total', 'Answers by where they came from', ('source',))
+        self.prompt_bytes_metric = metrics.histogram(
+            'agent_prompt_bytes', 'Encoded size of prompts sent upstream', buckets=SIZE_BUCKETS)
+        self.prompt_tokens_metric = metrics.histogram(
+            'agent_prompt_tokens', 'Estimated tokens of prompts sent upstream', buckets=TOKEN_BUCKETS)
+        self.usage_metric = metrics.histogram(
+            'upstream_usage_tokens', 'Token usage reported by the model', ('kind',), buckets=TOKEN_BUCKETS)
+
+        # Read at scrape time
+        metrics.gauge('agent_threads', 'Live Python threads').set_function(threading.active_count)
+        metrics.gauge('batch_queue_depth', 'Batch questions waiting for a worker').set_function(
+            lambda: self.batch_executor._work_queue.qsize())
+        metrics.gauge('coalesced_calls_in_flight', 'Distinct questions being answered upstream').set_function(
+            lambda: self.inflight.stats()['in_flight'])
+        metrics.gauge('answer_cache_entries', 'Answers held in the in-memory cache').set_function(
+            lambda: self.answer_cache.stats()['size'])
+        metrics.gauge('conversations_in_memory', 'Conversation entries held in memory').set_function(
+            lambda: len(self.conversations))
+
+        @self.app.before_request
+        def start_request_metrics():
+            g.metrics_started = time.perf_counter()
+            self.requests_in_flight_metric.inc()
+
+        @self.app.after_request
+        def record_request_metrics(response):
+            started = g.get('metrics_started')
+            if started is not None:
+                route = request.url_rule.rule if request.url_rule else 'unmatched'
+                self.request_metric.inc(route=route, method=request.method, status=response.status_code)
+                self.request_latency_metric.observe(time.perf_counter() - started, route=route, method=request.method)
+            return response
+
+        @self.app.teardown_request
+        def finish_request_metrics(error=None):
+            if g.pop('metrics_started', None) is not None:
+                self.requests_in_flight_metric.dec()
+
+    def stage(self, name):
+        """Time a stage of the chat path into agent_stage_duration_seconds"""
+        return self.stage_metric.time(stage=name)
+
+    def record_usage(self, data):
+        """Record the token usage block of a chat completion response, if any"""
+        usage = data.get('usage') or {}
+        for kind in ('prompt', 'completion'):
+            tokens = usage.get(f'{kind}_tokens')
+            if isinstance(tokens, int):
+                self.usage_metric.observe(tokens, kind=kind)
+
     def initialize_services(self):
         """Initialize AI services and load book content"""
-        # Try different environment variable names for API keys
-        api_keys_to_try = [
-            'GEMINI_API_KEY',
-            'DASHSCOPE_API_KEY', 
-            'OPENAI_API_KEY',
-            'OpenRouter_API_KEY'
-        ]
-        
-        for key_name in api_keys_to_try:
-            if os.getenv(key_name):
-                self.api_key = os.getenv(key_name)
-                logger.info(f"Using API key from {key_name}")
-                break
+        # Every environment variable with an API key registers a provider
+        for name, key_name, api_key, url, model in configured_providers():
+            logger.info(f"Using API key from {key_name} for {name} ({model} at {url})")
+            if self.api_key is None:
+                self.api_key = api_key
         
         if not self.api_key:
             logger.error("ERROR: No API key found!")
@@ -61,169 +277,327 @@ class BookSiteAIAgent:
             logger.error("- OpenRouter_API_KEY (for OpenRouter with Mistral model)")
             sys.exit(1)
 
-        # Load book content from Docusaurus docs
-        self.book_content = self.load_book_content_from_docs()
-        self.book_structure = self.build_book_structure()
+        # Load book content from Docusaurus docs (each file is read and parsed once)
+        self.load_book_content_from_docs()
+        self.docs_corpus.start_watching(self.docs_reload_interval, self.publish_corpus)
         logger.info("Book content and structure loaded successfully")
 
+    @property
+    def book_content(self):
+        """Combined book text of the current corpus snapshot"""
+        return self.corpus.book_content
+
+    @property
+    def book_structure(self):
+        """Chapters and topics of the current corpus snapshot"""
+        return self.corpus.book_structure
+
+    @property
+    def book_index(self):
+        """Retrieval index of the current corpus snapshot"""
+        return self.corpus.index
+
+    def publish_corpus(self, snapshot):
+        """Swap in a freshly built corpus snapshot"""
+        # A single attribute assignment, so requests see either the old or the new corpus
+        self.corpus = snapshot
+        # Render the cached prompt prefix and static payloads now rather than on first use
+        self.prompt_builder.prefix(snapshot)
+        self.book_info_payload(snapshot)
+        self.book_structure_payload(snapshot)
+        logger.info(f"Loaded corpus {snapshot.version}: {len(snapshot.records)} docs, "
+                    f"{len(snapshot.index.chunks)} chunks")
+
+    def book_info_payload(self, corpus):
+        """Precomputed /api/book-info response for a corpus snapshot"""
+        def render():
+            structure = corpus.book_structure
+            return self.app.json.dumps({
+                'title': "Physical AI: Human-Robot Artificial Intelligence",
+                'description': "An advanced guide to combining artificial intelligence with physical systems, particularly robots, exploring how AI algorithms can be applied to control, sense, and interact with the physical world.",
+                'chapters': structure['chapters'],
+                'topics': structure['topics'],
+                'total_chapters': len(structure['chapters']),
+                'total_topics': len(structure['topics']),
+                'loaded': True
+            }).encode('utf-8')
+        return self.payloads.get('book-info', corpus.version, render)
+
+    def book_structure_payload(self, corpus):
+        """Precomputed /api/book-structure response for a corpus snapshot"""
+        def render():
+            return self.app.json.dumps({
+                'success': True,
+                'structure': corpus.book_structure
+            }).encode('utf-8')
+        return self.payloads.get('book-structure', corpus.version, render)
+
+    def send_page(self, path):
+        """Send an HTML page; it is revalidated on every load so edits show up at once"""
+        return send_file(path, etag=self.static_hashes.etag(str(path)), max_age=0)
+
     def build_book_structure(self):
         """Build the book structure with chapters and topics"""
-        structure = {
-            'chapters': [],
-            'sections': [],
-            'topics': []
+        return self.corpus.book_structure
+
+    def load_book_content_from_docs(self):
+        """Load book content from Docusaurus docs directory"""
+        self.publish_corpus(self.docs_corpus.load())
+        return self.corpus.book_content
+
+    def build_book_context(self, question, corpus=None):
+        """Select the book text that is sent to the model for a question"""
+        corpus = corpus or self.corpus
+        if self.retrieval_full_content:
+            return corpus.book_content
+
+        chunks = corpus.index.select_context(
+            question,
+            top_k=self.retrieval_top_k,
+            token_budget=self.retrieval_token_budget
+        )
+        return format_chunks(chunks)
+
+    def build_prompt(self, question, corpus=None, history=None):
+        """Build the context-aware prompt for a question, with conversation history if any"""
+        corpus = corpus or self.corpus
+        book_context = None
+        if not self.retrieval_full_content:
+            # "Explain that in more detail" retrieves little on its own; the previous question fills in
+            query = f"{history['last_question']}\n{question}" if history and history['last_question'] else question
+            with self.stage('retrieval'):
+                book_context = self.build_book_context(query, corpus)
+        with self.stage('prompt_build'):
+            prompt = self.prompt_builder.build(corpus, question, book_context, history['text'] if history else None)
+
+        prompt['tokens'] = estimate_tokens(prompt['system']) + estimate_tokens(prompt['user'])
+        self.prompt_bytes_metric.observe(prompt['bytes'])
+        self.prompt_tokens_metric.observe(prompt['tokens'])
+        return prompt
+
+    def answer_cache_key(self, question, corpus):
+        """Cache key covering everything an answer depends on"""
+        # A docs reload changes the corpus version, which invalidates old answers
+        return make_cache_key(question, corpus.version, self.prompt_fingerprint)
+
+    def prepare_answer(self, question, corpus=None, conversation_id=None):
+        """Work out how a question will be answered before calling the AI API
+
+        Returns an answer dict holding the cache key and either the cached
+        response or the prompt to send. The blocking, streaming and async
+        chat paths all share it.
+        """
+        corpus = corpus or self.corpus
+        answer = {
+            'question': question,
+            'corpus': corpus,
+            'key': None,
+            'prompt': None,
+            'response': None,
+            'cached': False,
+            'coalesced': False,
+            'similar': None,
+            'history': self.conversation_memory.context(conversation_id)
         }
 
-        docs_path = Path(__file__).parent / 'book' / 'book-site' / 'docs'
+        if answer['history']:
+            # The answer depends on earlier turns, so it is neither served from nor stored in the shared caches
+            answer['key'] = make_cache_key(question, corpus.version, self.prompt_fingerprint, answer['history']['text'])
+            answer['prompt'] = self.build_prompt(question, corpus, answer['history'])
+            return answer
 
-        try:
-            if docs_path.exists():
-                # Get all markdown files
-                for file_path in docs_path.rglob('*.md'):
-                    if file_path.is_file():
-                        # Read file content to extract title
-                        content = file_path.read_text(encoding='utf-8')
-                        title = self.extract_title(content, file_path.name)
-                        
-                        # Add to chapters list
-                        relative_path = file_path.relative_to(docs_path)
-                        structure['chapters'].append({
-                            'id': str(relative_path),
-                            'title': title,
-                            'path': str(relative_path),
-                            'directory': file_path.parent.name
-                        })
-
-                # Extract topics from content
-                topics = self.extract_topics(self.book_content)
-                structure['topics'] = topics
-
-            return structure
-        except Exception as e:
-            logger.warning(f"Could not build book structure: {str(e)}")
-            return structure
+        # The key also identifies identical in-flight questions, even with the cache off
+        answer['key'] = self.answer_cache_key(question, corpus)
+        if self.answer_cache.enabled:
+            with self.stage('cache_lookup'):
+                response = self.answer_cache.get(answer['key'])
+            if response is not None:
+                self.answers_metric.inc(source='cache')
+                logger.info('Answer served from cache')
+                answer.update(response=response, cached=True)
+                return answer
 
-    def extract_title(self, content, filename):
-        """Extract title from markdown content"""
-        lines = content.split('\n')
-        
-        # Look for first heading
-        for line in lines:
-            if line.startswith('# '):
-                return line[2:].strip()
-        
-        # Fallback to filename
-        return filename.replace('.md', '').replace('-', ' ').replace('_', ' ')
+            if self.similar_questions.enabled:
+                with self.stage('similar_lookup'):
+                    match = self.similar_questions.get(question, self.similar_questions_scope(corpus))
+                if match is not None:
+                    self.answers_metric.inc(source='similar')
+                    logger.info(f"Answer reused from a similar question (similarity {match['score']})")
+                    answer.update(response=match['answer'], cached=True,
+                                  similar={'question': match['question'], 'score': match['score']})
+                    return answer
 
-    def extract_topics(self, content):
-        """Extract topics from headings in the content"""
-        topics = []
-        lines = content.split('\n')
-        
-        for line in lines:
-            if line.startswith('## '):
-                topic = line[3:].strip()
-                if topic not in topics:
-                    topics.append(topic)
-        
-        return topics
+        answer['prompt'] = self.build_prompt(question, corpus)
+        return answer
 
-    def load_book_content_from_docs(self):
-        """Load book content from Docusaurus docs directory"""
-        docs_path = Path(__file__).parent / 'book' / 'book-site' / 'docs'
+    def similar_questions_scope(self, corpus):
+        """Near-duplicate matches only count within one corpus version and prompt setup"""
+        return f"{corpus.version}:{self.prompt_fingerprint}"
 
-        try:
-            content = "# Physical AI: Human-Robot Artificial Intelligence\n\n"
-
-            if docs_path.exists():
-                # Read content from all markdown files
-                for file_path in docs_path.rglob('*.md'):
-                    if file_path.is_file():
-                        file_content = file_path.read_text(encoding='utf-8')
-
-                        # Remove frontmatter if present (between --- delimiters)
-                        lines = file_content.split('\n')
-                        if len(lines) > 2 and lines[0] == '---':
-                            # Find the end of frontmatter
-                            frontmatter_end = -1
-                            for i, line in enumerate(lines[1:], 1):
-                                if line == '---':
-                                    frontmatter_end = i
-                                    break
-                            
-                            if frontmatter_end > 0:
-                                file_content = '\n'.join(lines[frontmatter_end + 1:])
-
-                        content += f"\n\n## From {file_path.name}\n\n{file_content}"
-
-            return content
-        except Exception as e:
-            logger.warning(f"Could not read docs directory, using default content: {str(e)}")
-            
-            # Return default book content if docs can't be read
-            return """
-                # Physical AI: Human-Robot Artificial Intelligence
+    def finish_answer(self, answer, response):
+        """Store a fresh answer from the AI API"""
+        answer['response'] = response
+        if self.answer_cache.enabled and not answer['history']:
+            self.answer_cache.put(answer['key'], response)
+            self.similar_questions.put(answer['question'], self.similar_questions_scope(answer['corpus']), response)
+        return answer
 
-                ## Chapter 1: Introduction to Physical AI
-                Physical AI refers to the integration of artificial intelligence with physical systems, particularly robots. It involves AI algorithms that control, sense, and interact with the physical world.
+    def get_answer(self, question, corpus=None, priority='interactive', conversation_id=None):
+        """Answer a question from the cache or the AI API
 
-                ## Chapter 2: Hardware Components in Physical AI Systems
-                Physical AI systems require specialized hardware including sensors, actuators, and computing units that can operate in real-time environments.
+        Identical questions that arrive while one is already being answered
+        wait for that call instead of issuing their own. `priority` orders
+        the call in the upstream rate limiter's queue.
+        """
+        answer = self.prepare_answer(question, corpus, conversation_id)
+        if answer['cached']:
+            return answer
 
-                ## Chapter 3: Sensors and Perception in Physical AI
-                Sensory perception is crucial for Physical AI systems. Common sensors include cameras, LIDAR, ultrasonic sensors, and IMUs that provide environmental awareness.
+        def fetch():
+            # Cache before waking followers so late arrivals hit the cache
+            return self.finish_answer(answer, self.call_ai_api(answer['prompt'], priority))['response']
 
-                ## Chapter 4: Human-Robot Interaction in Physical AI
-                Effective human-robot interaction requires intuitive interfaces, safety mechanisms, and responsive behaviors that align with human expectations.
+        response, coalesced = self.inflight.do(answer['key'], fetch)
+        if coalesced:
+            logger.info('Answer shared with an identical in-flight question')
+            answer.update(response=response, coalesced=True)
+        self.answers_metric.inc(source='coalesced' if coalesced else 'upstream')
+        return answer
 
-                ## Chapter 5: Machine Learning in Physical AI Systems
-                Machine learning algorithms enable Physical AI systems to adapt to new situations, learn from experience, and improve performance over time.
-            """
+    def build_ai_request(self, prompt, stream=False, provider=None):
+        """Headers and body for a chat completion request to a provider
 
-    def call_ai_api(self, prompt):
-        """Call the AI API with the given prompt"""
-        # Using OpenRouter API as in the original implementation
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        
+        The body is a dict for plain string prompts, or ready-made JSON bytes
+        for prompts built by PromptBuilder. Without a provider the first
+        configured one is used.
+        """
         headers = {
-            "Authorization": f"Bearer {self.api_key}",
+            "Authorization": f"Bearer {provider.api_key if provider else self.api_key}",
             "Content-Type": "application/json",
             "HTTP-Referer": f"http://localhost:{self.port}",
             "X-Title": "Physical AI Book Assistant"
         }
         
-        payload = {
-            "model": "mistralai/devstral-2512:free",  # Free Mistral model
-            "messages": [
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": "Please provide a helpful response based on the context provided."}
-            ],
+        options = {
+            "model": provider.model if provider else self.ai_model,
             "temperature": 0.7,
-            "max_tokens": 1000
+            "max_tokens": MAX_COMPLETION_TOKENS
         }
+        if stream:
+            options["stream"] = True
+
+        if isinstance(prompt, str):
+            payload = dict(options, messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": "Please provide a helpful response based on the context provided."}
+            ])
+            return headers, payload
+
+        # Splice the pre-encoded system prefix in rather than re-encoding the whole prompt
+        body = b''.join([
+            b'{"messages": [{"role": "system", "content": ',
+            prompt['system_encoded'],
+            b'}, {"role": "user", "content": ',
+            prompt['user_encoded'],
+            b'}], ',
+            json.dumps(options)[1:].encode('utf-8')
+        ])
+        return headers, body
+
+    def request_tokens(self, prompt):
+        """Token cost of a call charged to the rate limiter up front; corrected from usage later"""
+        if isinstance(prompt, str):
+            return estimate_tokens(prompt) + MAX_COMPLETION_TOKENS
+        return prompt['tokens'] + MAX_COMPLETION_TOKENS
+
+    def call_ai_api(self, prompt, priority='interactive'):
+        """Call the AI API with the given prompt"""
+        def build(provider):
+            with self.stage('request_encode'):
+                return self.build_ai_request(prompt, provider=provider)
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
+            with self.stage('upstream'):
+                data = self.router.post_json(build, self.request_tokens(prompt), priority)
+            self.record_usage(data)
             if 'choices' in data and len(data['choices']) > 0:
                 return data['choices'][0]['message']['content'].strip()
             else:
                 raise Exception("No response from AI API")
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error calling AI API: {str(e)}")
-            if hasattr(e, 'response') and e.response is not None:
-                if e.response.status_code == 429:
-                    raise Exception("API quota exceeded")
-                elif e.response.status_code >= 500:
-                    raise Exception("Server unavailable")
-                elif e.response.status_code == 401:
-                    raise Exception("Invalid API key")
-                else:
-                    raise Exception(f"API error: {e.response.status_code} - {e.response.reason}")
+            self.raise_api_error(e)
+
+    def stream_ai_api(self, prompt, priority='interactive'):
+        """Call the AI API in streaming mode and yield text deltas"""
+        def build(provider):
+            with self.stage('request_encode'):
+                return self.build_ai_request(prompt, stream=True, provider=provider)
+
+        try:
+            yield from self.router.stream_chat(build, self.request_tokens(prompt), priority)
+        except requests.exceptions.RequestException as e:
+            self.raise_api_error(e)
+
+    def raise_api_error(self, e):
+        """Translate a requests exception into the agent's API error messages"""
+        if isinstance(e, requests.exceptions.Timeout):
+            logger.error(f"Timed out calling AI API: {str(e)}")
+            raise Exception("Upstream timeout")
+
+        logger.error(f"Error calling AI API: {str(e)}")
+        if hasattr(e, 'response') and e.response is not None:
+            if e.response.status_code == 429:
+                raise Exception("API quota exceeded")
+            elif e.response.status_code >= 500:
+                raise Exception("Server unavailable")
+            elif e.response.status_code == 401:
+                raise Exception("Invalid API key")
             else:
-                raise Exception("Network error: Unable to reach the API server")
+                reason = getattr(e.response, 'reason', None) or getattr(e.response, 'reason_phrase', '')
+                raise Exception(f"API error: {e.response.status_code} - {reason}")
+        else:
+            raise Exception("Network error: Unable to reach the API server")
+
+    def record_conversation(self, question, response, conversation_id=None):
+        """Store a question and its answer in conversation history and memory"""
+        entry = self.conversations.add(question, response, conversation_id)
+        self.conversation_memory.record(entry['conversation_id'], question, response)
+        return entry
+
+    def summarize_conversation(self, summary, turns):
+        """Fold older turns into a conversation's running summary; called off the request path"""
+        transcript = render_turns(turns)
+        if summary:
+            transcript = f"Summary so far: {summary}\n\n{transcript}"
+        words = self.conversation_memory.summary_tokens * 3 // 4
+
+        def build(provider):
+            headers, options = self.build_ai_request('', provider=provider)
+            options.update(max_tokens=self.conversation_memory.summary_tokens, temperature=0.2, messages=[
+                {"role": "system", "content": SUMMARY_PROMPT.format(words=words)},
+                {"role": "user", "content": transcript}
+            ])
+            return headers, options
+
+        tokens = estimate_tokens(transcript) + self.conversation_memory.summary_tokens
+        data = self.router.post_json(build, tokens, priority='batch')
+        self.record_usage(data)
+        return data['choices'][0]['message']['content']
+
+    def chat_error(self, e):
+        """Map an exception from the chat path to (error message, HTTP status)"""
+        if str(e) == 'API quota exceeded':
+            return 'API quota exceeded. Please check your account.', 429
+        elif str(e) == 'Server unavailable':
+            return 'Server unavailable. Please try again later.', 503
+        elif str(e) == 'Upstream queue full':
+            return 'The assistant is busy right now. Please try again shortly.', 503
+        elif str(e) == 'Upstream timeout':
+            return 'The AI service took too long to respond. Please try again.', 504
+        elif str(e) == 'Invalid API key':
+            return 'Invalid API key', 401
+        else:
+            return f'Internal server error: {str(e)}', 500
 
     def setup_routes(self):
         """Setup application routes"""
@@ -231,9 +605,9 @@ class BookSiteAIAgent:
         @self.app.route('/')
         def home():
             try:
-                html_path = Path(__file__).parent / 'ai-chatbot' / 'index.html'
+                html_path = self.static_dir / 'index.html'
                 if html_path.exists():
-                    return send_file(html_path)
+                    return self.send_page(html_path)
                 else:
                     return '<h1>AI Book Agent - Home</h1><p>Welcome to the AI Book Agent assistant.</p>', 200
             except Exception as e:
@@ -244,9 +618,9 @@ class BookSiteAIAgent:
         @self.app.route('/book-site-integration')
         def book_site_integration():
             try:
-                html_path = Path(__file__).parent / 'ai-chatbot' / 'book-site-integration.html'
+                html_path = self.static_dir / 'book-site-integration.html'
                 if html_path.exists():
-                    return send_file(html_path)
+                    return self.send_page(html_path)
                 else:
                     return '<h1>Book Site Integration</h1><p>Book site integration page.</p>', 200
             except Exception as e:
@@ -260,7 +634,7 @@ class BookSiteAIAgent:
                 data = request.get_json()
                 question = data.get('question', '').strip()
                 context = data.get('context', None)
-                conversation_id = data.get('conversation_id', None)
+                conversation_id = normalize_conversation_id(data.get('conversation_id'))
 
                 logger.info(f'AI Agent received question: {question}')
 
@@ -270,105 +644,134 @@ class BookSiteAIAgent:
                         'error': 'Question is required'
                     }), 400
 
-                # Build context-aware prompt for the agent
-                system_prompt = f"""You are an advanced AI Agent for the "Physical AI: Human-Robot Artificial Intelligence" book.
-                Your capabilities include:
-                1. Answering questions about the book content
-                2. Providing detailed explanations of concepts
-                3. Guiding users to specific chapters or sections
-                4. Summarizing key topics
-                5. Making connections between different concepts
+                # Read one corpus snapshot for the whole request
+                corpus = self.corpus
 
-                Book Structure:
-                Chapters: {', '.join([ch['title'] for ch in self.book_structure['chapters']])}
-                Topics: {', '.join(self.book_structure['topics'][:10])} (first 10 topics)
+                # Answer from the cache when possible, otherwise ask the AI API
+                answer = self.get_answer(question, corpus, conversation_id=conversation_id)
+                response = answer['response']
 
-                Use the following book information to answer the user's question:
+                # Store in conversation history
+                with self.stage('conversation_record'):
+                    conversation_entry = self.record_conversation(question, response, conversation_id)
+
+                with self.stage('suggestions'):
+                    suggestions = self.generate_suggestions(question, corpus)
 
-                {self.book_content}
+                with self.stage('serialize'):
+                    return jsonify({
+                        'success': True,
+                        'response': response,
+                        'cached': answer['cached'],
+                        'coalesced': answer['coalesced'],
+                        'similar': answer['similar'],
+                        'conversation_id': conversation_entry['conversation_id'],
+                        'entry_id': conversation_entry['id'],
+                        'timestamp': datetime.utcnow().isoformat() + 'Z',
+                        'suggestions': suggestions
+                    })
+
+            except Exception as e:
+                logger.error(f'Error processing agent chat request: {str(e)}')
+                error, status = self.chat_error(e)
+                return jsonify({
+                    'success': False,
+                    'error': error
+                }), status
 
-                Provide a helpful, accurate, and comprehensive response based on the book content.
-                When relevant, suggest specific chapters or sections that might interest the user.
-                Keep your responses informative and well-structured.
+        # Streaming variant of the chat endpoint (Server-Sent Events)
+        @self.app.route('/api/agent/chat/stream', methods=['POST'])
+        def agent_chat_stream():
+            data = request.get_json(silent=True) or {}
+            question = data.get('question', '').strip()
+            conversation_id = normalize_conversation_id(data.get('conversation_id'))
 
-                User Question: {question}"""
+            logger.info(f'AI Agent received streaming question: {question}')
 
-                # Process the message using the AI API
-                response = self.call_ai_api(system_prompt)
+            if not question:
+                return jsonify({
+                    'success': False,
+                    'error': 'Question is required'
+                }), 400
 
-                # Store in conversation history
-                conversation_entry = {
-                    'id': str(int(datetime.now().timestamp() * 1000)),
-                    'timestamp': datetime.utcnow().isoformat() + 'Z',
-                    'question': question,
-                    'response': response,
-                    'conversation_id': conversation_id or 'default'
+            return Response(
+                self.stream_answer(question, conversation_id),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'
                 }
+            )
 
-                self.conversation_history.append(conversation_entry)
+        # Batch question endpoint for pre-generating answers (quiz banks, chapter FAQs)
+        @self.app.route('/api/agent/chat/batch', methods=['POST'])
+        def agent_chat_batch():
+            data = request.get_json(silent=True) or {}
+            questions = data.get('questions')
 
-                # Keep only last 50 conversations to prevent memory issues
-                if len(self.conversation_history) > 50:
-                    self.conversation_history = self.conversation_history[-50:]
+            if not isinstance(questions, list) or not questions:
+                return jsonify({
+                    'success': False,
+                    'error': 'A non-empty list of questions is required'
+                }), 400
 
+            if len(questions) > self.batch_max_questions:
                 return jsonify({
-                    'success': True,
-                    'response': response,
-                    'conversation_id': conversation_entry['id'],
-                    'timestamp': datetime.utcnow().isoformat() + 'Z',
-                    'suggestions': self.generate_suggestions(question)
-                })
+                    'success': False,
+                    'error': f'At most {self.batch_max_questions} questions per batch'
+                }), 400
 
-            except Exception as e:
-                logger.error(f'Error processing agent chat request: {str(e)}')
-                
-                if str(e) == 'API quota exceeded':
-                    return jsonify({
-                        'success': False,
-                        'error': 'API quota exceeded. Please check your account.'
-                    }), 429
-                elif str(e) == 'Server unavailable':
-                    return jsonify({
-                        'success': False,
-                        'error': 'Server unavailable. Please try again later.'
-                    }), 503
-                elif str(e) == 'Invalid API key':
-                    return jsonify({
-                        'success': False,
-                        'error': 'Invalid API key'
-                    }), 401
-                else:
-                    return jsonify({
-                        'success': False,
-                        'error': f'Internal server error: {str(e)}'
-                    }), 500
+            logger.info(f'AI Agent received batch of {len(questions)} questions')
+            return jsonify(self.answer_batch(questions))
+
+        # Autocomplete for the chat box
+        @self.app.route('/api/suggest', methods=['GET'])
+        def suggest():
+            query = request.args.get('q', '')
+            try:
+                limit = min(max(int(request.args.get('limit', 8)), 1), 50)
+            except ValueError:
+                limit = 8
+
+            return jsonify({
+                'success': True,
+                'query': query,
+                'suggestions': self.corpus.suggestions.search(query, limit=limit)
+            })
 
         # Enhanced book information endpoint
         @self.app.route('/api/book-info', methods=['GET'])
         def book_info():
-            return jsonify({
-                'title': "Physical AI: Human-Robot Artificial Intelligence",
-                'description': "An advanced guide to combining artificial intelligence with physical systems, particularly robots, exploring how AI algorithms can be applied to control, sense, and interact with the physical world.",
-                'chapters': self.book_structure['chapters'],
-                'topics': self.book_structure['topics'],
-                'total_chapters': len(self.book_structure['chapters']),
-                'total_topics': len(self.book_structure['topics']),
-                'loaded': True
-            })
+            return self.book_info_payload(self.corpus).response(request)
 
         # Get conversation history
         @self.app.route('/api/conversations', methods=['GET'])
         def get_conversations():
+            try:
+                limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+                conversations, next_cursor = self.conversations.list(
+                    cursor=request.args.get('cursor'),
+                    limit=limit,
+                    conversation_id=request.args.get('conversation_id')
+                )
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid cursor or limit'
+                }), 400
+
             return jsonify({
                 'success': True,
-                'conversations': self.conversation_history,
-                'count': len(self.conversation_history)
+                'conversations': conversations,
+                'count': len(conversations),
+                'next_cursor': next_cursor,
+                'total': self.conversations.total()
             })
 
         # Get specific conversation
         @self.app.route('/api/conversations/<conversation_id>', methods=['GET'])
         def get_conversation(conversation_id):
-            conversation = next((c for c in self.conversation_history if c['id'] == conversation_id), None)
+            conversation = self.conversations.get(conversation_id)
 
             if not conversation:
                 return jsonify({
@@ -384,15 +787,65 @@ class BookSiteAIAgent:
         # Get book structure
         @self.app.route('/api/book-structure', methods=['GET'])
         def book_structure():
-            return jsonify({
-                'success': True,
-                'structure': self.book_structure
-            })
+            return self.book_structure_payload(self.corpus).response(request)
 
         # Serve static files from ai-chatbot directory
         @self.app.route('/static/<path:filename>')
         def static_files(filename):
-            return send_from_directory(Path(__file__).parent / 'ai-chatbot', filename)
+            # Content-hash ETag so a redeploy with new bytes is picked up even if mtimes lie
+            path = safe_join(str(self.static_dir), filename)
+            etag = self.static_hashes.etag(path) if path and os.path.isfile(path) else True
+            return send_from_directory(self.static_dir, filename, etag=etag)
+
+        # Upstream client and cache statistics for monitoring
+        @self.app.route('/api/agent/stats', methods=['GET'])
+        def agent_stats():
+            return jsonify({
+                'success': True,
+                'upstream': self.router.stats(),
+                'cache': self.answer_cache.stats(),
+                'conversation_memory': self.conversation_memory.stats(),
+                'similar_questions': self.similar_questions.stats(),
+                'coalescing': self.inflight.stats(),
+                'conversations': self.conversations.stats(),
+                'prompt': self.prompt_builder.stats(),
+                'corpus_snapshots': self.docs_corpus.store.stats() if self.docs_corpus.store else None,
+                'async': self.async_app.stats() if self.async_app else None
+            })
+
+        # Prometheus text exposition of the agent's metrics
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics():
+            return Response(self.metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+        # Sampling profiler: POST {"action": "start"|"stop"}, GET for the hottest stacks
+        @self.app.route('/api/agent/profile', methods=['GET', 'POST'])
+        def profile():
+            if not self.profiler_endpoint:
+                return jsonify({'error': 'Endpoint not found'}), 404
+
+            if request.method == 'POST':
+                data = request.get_json(silent=True) or {}
+                action = data.get('action')
+                if action == 'start':
+                    interval_ms = data.get('interval_ms')
+                    self.profiler.start(interval=float(interval_ms) / 1000 if interval_ms else None)
+                elif action == 'stop':
+                    self.profiler.stop()
+                else:
+                    return jsonify({
+                        'success': False,
+                        'error': 'action must be "start" or "stop"'
+                    }), 400
+
+            if request.args.get('format') == 'folded':
+                return Response(self.profiler.folded(), content_type='text/plain; charset=utf-8')
+
+            return jsonify({
+                'success': True,
+                'profiler': self.profiler.stats(),
+                'top': self.profiler.top(int(request.args.get('limit', 20)))
+            })
 
         # Health check endpoint
         @self.app.route('/health', methods=['GET'])
@@ -410,28 +863,120 @@ class BookSiteAIAgent:
                 ]
             })
 
-    def generate_suggestions(self, question):
+    def answer_batch(self, questions):
+        """Answer a list of questions, asking the AI API once per distinct question"""
+        started = time.perf_counter()
+        corpus = self.corpus
+
+        # Questions that normalize to the same text are answered once
+        first_index = {}
+        items = []
+        for index, question in enumerate(questions):
+            question = str(question or '').strip()
+            item = {'index': index, 'question': question}
+            normalized = normalize_question(question)
+            if not question:
+                item.update(success=False, error='Question is required', status=400, elapsed_ms=0.0)
+            elif normalized in first_index:
+                item['duplicate_of'] = first_index[normalized]
+            else:
+                first_index[normalized] = index
+            items.append(item)
+
+        def answer_one(item):
+            item_started = time.perf_counter()
+            try:
+                # Queued behind interactive chats when the upstream quota runs low
+                answer = self.get_answer(item['question'], corpus, priority='batch')
+                result = {'success': True, 'response': answer['response'], 'cached': answer['cached'],
+                          'coalesced': answer['coalesced'], 'similar': answer['similar']}
+            except Exception as e:
+                logger.error(f"Error answering batch question {item['index']}: {str(e)}")
+                error, status = self.chat_error(e)
+                result = {'success': False, 'error': error, 'status': status}
+            result['elapsed_ms'] = round((time.perf_counter() - item_started) * 1000, 2)
+            return result
+
+        unique = [items[index] for index in first_index.values()]
+        for item, result in zip(unique, self.batch_executor.map(answer_one, unique)):
+            item.update(result)
+
+        for item in items:
+            if 'duplicate_of' in item:
+                original = items[item['duplicate_of']]
+                item.update({key: value for key, value in original.items()
+                             if key not in ('index', 'question', 'elapsed_ms')})
+                item['elapsed_ms'] = 0.0
+
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        return {
+            'success': True,
+            'results': items,
+            'total_questions': len(items),
+            'unique_questions': len(unique),
+            'failed': sum(1 for item in items if not item['success']),
+            'elapsed_ms': elapsed_ms,
+            # What the same questions would have cost one after another
+            'sequential_ms': round(sum(item['elapsed_ms'] for item in unique), 2),
+            'concurrency': self.batch_concurrency
+        }
+
+    def stream_answer(self, question, conversation_id=None):
+        """Generate SSE events for a streamed answer"""
+        corpus = self.corpus
+        try:
+            answer = self.prepare_answer(question, corpus, conversation_id)
+
+            if answer['cached']:
+                yield sse_event('token', {'text': answer['response']})
+            else:
+                parts = []
+                for text in self.stream_ai_api(answer['prompt']):
+                    parts.append(text)
+                    yield sse_event('token', {'text': text})
+                response = ''.join(parts).strip()
+                if not response:
+                    raise Exception("No response from AI API")
+                self.finish_answer(answer, response)
+                self.answers_metric.inc(source='upstream')
+
+            conversation_entry = self.record_conversation(question, answer['response'], conversation_id)
+            yield sse_event('done', {
+                'success': True,
+                'cached': answer['cached'],
+                'similar': answer['similar'],
+                'conversation_id': conversation_entry['conversation_id'],
+                'entry_id': conversation_entry['id'],
+                'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'suggestions': self.generate_suggestions(question, corpus)
+            })
+        except Exception as e:
+            logger.error(f'Error processing streaming chat request: {str(e)}')
+            error, status = self.chat_error(e)
+            yield sse_event('error', {
+                'success': False,
+                'error': error,
+                'status': status
+            })
+
+    def generate_suggestions(self, question, corpus=None):
         """Generate context-aware suggestions based on the question"""
+        corpus = corpus or self.corpus
         suggestions = []
-        
-        # Look for relevant topics in the question
-        question_lower = question.lower()
-        
+
         # Find matching topics
-        matching_topics = [topic for topic in self.book_structure['topics'] 
-                          if question_lower in topic.lower() or 
-                          topic.lower() in question_lower]
-        
+        matching_topics = [entry['text'] for entry in
+                           corpus.suggestions.search(question, limit=3, kinds=('topic',), partial=False)]
+
         if matching_topics:
-            suggestions.append(f"You might also be interested in learning more about: {', '.join(matching_topics[:3])}")
-        
+            suggestions.append(f"You might also be interested in learning more about: {', '.join(matching_topics)}")
+
         # Find relevant chapters
-        relevant_chapters = [chapter for chapter in self.book_structure['chapters'] 
-                            if question_lower in chapter['title'].lower()]
-        
+        relevant_chapters = corpus.suggestions.search(question, limit=1, kinds=('chapter',), partial=False)
+
         if relevant_chapters:
-            suggestions.append(f"See chapter: {relevant_chapters[0]['title']}")
-        
+            suggestions.append(f"See chapter: {relevant_chapters[0]['text']}")
+
         return suggestions
 
     def setup_error_handlers(self):
@@ -450,6 +995,15 @@ class BookSiteAIAgent:
             logger.error(f"Unhandled exception: {str(e)}")
             return jsonify({'error': 'An unexpected error occurred'}), 500
 
+    def create_asgi_app(self):
+        """ASGI app with the chat endpoints on the event loop"""
+        from book_agent.asgi import AsyncChatApp
+        return AsyncChatApp(
+            self,
+            max_concurrency=int(os.getenv('UPSTREAM_CONCURRENCY', 64)),
+            max_waiting=int(os.getenv('UPSTREAM_QUEUE_LIMIT', 1024))
+        )
+
     def init(self):
         """Initialize and start the application"""
         try:
@@ -461,6 +1015,17 @@ class BookSiteAIAgent:
             print(f'📚 Book Info API available at http://localhost:{self.port}/api/book-info')
             print(f'📡 Health check available at http://localhost:{self.port}/health')
             
+            # Production mode: chats run on an asyncio event loop under uvicorn
+            if os.getenv('SERVER_MODE', 'flask').lower() == 'asgi':
+                import uvicorn
+                uvicorn.run(
+                    self.create_asgi_app(),
+                    host='0.0.0.0',
+                    port=self.port,
+                    log_level='info'
+                )
+                return
+
             # Run the Flask app
             self.app.run(
                 host='0.0.0.0',
@@ -476,6 +1041,11 @@ class BookSiteAIAgent:
             sys.exit(1)
 
 
+def create_asgi_app():
+    """Factory for ASGI servers, e.g. `uvicorn book_site_ai_agent:create_asgi_app --factory`"""
+    return BookSiteAIAgent().create_asgi_app()
+
+
 # If running directly, initialize the application
 if __name__ == '__main__':
     agent = BookSiteAIAgent()